@@ -2,123 +2,482 @@
 
 import argparse
 from argparse import HelpFormatter, RawTextHelpFormatter
+import bz2
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+import fnmatch
 import gzip
+import hashlib
+import heapq
 import http.client
 from io import StringIO
 import logging
 import json
+import lzma
 import os
 import re
 import shutil
+import sqlite3
 import sys
 import tempfile
+import threading
 import traceback
 import typing
-from urllib.parse import urlparse
+from urllib.parse import urljoin, urlparse
 
 LOG_LEVEL = logging.INFO
 if 'LOG_LEVEL' in os.environ:
     LOG_LEVEL = getattr(logging, os.environ['LOG_LEVEL'].upper())
 LOG = logging.getLogger(__name__)
-logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s [%(levelname)s] %(message)s', stream=sys.stdout)
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s [%(levelname)s] %(message)s', stream=sys.stderr)
 
-def read_to(f :typing.IO[str], regexp :str) -> typing.Optional[str]:
-    """Reads lines from a file until one is encountered with the given
-    line_prefix or EOF is reached. The latter is indicated by a None return."""
+RELATION_FIELDS = {'Depends', 'Pre-Depends', 'Recommends', 'Suggests', 'Enhances', 'Breaks', 'Conflicts',
+                   'Replaces', 'Provides', 'Built-Using', 'Build-Depends', 'Build-Depends-Indep',
+                   'Build-Depends-Arch', 'Build-Conflicts', 'Build-Conflicts-Indep', 'Build-Conflicts-Arch'}
+"""Fields that hold package relationships (see deb-control(5))."""
+
+RELATION = re.compile(r'^\s*([^\s:(\[<]+)(?::(\S+?))?\s*(?:\(\s*(<<|<=|>=|>>|=|<|>)\s*([^)\s]+)\s*\))?\s*(?:\[([^\]]*)\])?\s*(?:<(.*)>)?\s*$')
+"""Pattern that matches a single package relationship such as `libc6:amd64 (>= 2.34) [linux-any] <!nocheck>`."""
+
+COMPRESSIONS = {'.xz': lzma.open, '.bz2': bz2.open, '.gz': gzip.open, '': open}
+"""Supported index file compressions (by file suffix) and how to open them.
+Note that .zst (zstd) indices are not supported by the standard library."""
+
+REVERSE_INDEX_SCHEMA = """
+CREATE TABLE rdepends (name TEXT, package TEXT, version TEXT, field TEXT, relation TEXT);
+CREATE TABLE provides (name TEXT, package TEXT, version TEXT, provided TEXT);
+"""
+"""Schema of the reverse relationship index of a Packages file."""
+
+CONNECTIONS = threading.local()
+"""Each thread's keep-alive connections, keyed on (scheme, netloc)."""
+
+def iter_paragraphs(f :typing.IO[str]) -> typing.Iterator[typing.Dict[str, str]]:
+    """Yields the paragraphs of a deb822 control file (such as Packages or
+    Sources) one at a time, as dicts of field name to value. Continuation
+    lines are appended to their field's value, separated by newlines and
+    with their leading whitespace kept."""
+    para = {}
+    field = None
     for line in f:
-        if re.match(regexp, line):
-            return line
-    return None
+        if line.isspace():
+            if para:
+                yield para
+                para = {}
+                field = None
+        elif line[0] in ' \t':
+            if field is not None:
+                para[field] += '\n' + line.rstrip('\n')
+        elif line[0] != '#':
+            field, _, value = line.partition(':')
+            para[field] = value.strip()
+    if para:
+        yield para
+
+def parse_relations(value :str) -> typing.List[typing.List[dict]]:
+    """Parses a relationship field (such as Depends) into a list of
+    alternatives, each being a list of relations of the form
+    {"name", "arch", "version": {"op", "version"} or None, "archs", "profiles"}."""
+    alternatives = []
+    for group in value.split(','):
+        if not group.strip():
+            continue
+        relations = []
+        for rel in group.split('|'):
+            m = RELATION.match(rel)
+            if not m:
+                raise ValueError(f'invalid relationship: {rel.strip()}')
+            name, arch, op, version, archs, profiles = m.groups()
+            relations.append({
+                'name': name,
+                'arch': arch,
+                'version': {'op': op, 'version': version} if op else None,
+                'archs': archs.split() if archs else None,
+                'profiles': profiles,
+            })
+        alternatives.append(relations)
+    return alternatives
+
+def format_relation(relation :dict) -> str:
+    """Formats a relation (as parsed by parse_relations) such as `libc6:amd64 (>= 2.34)`."""
+    text = relation['name'] + (f':{relation["arch"]}' if relation['arch'] else '')
+    if relation['version']:
+        text += f' ({relation["version"]["op"]} {relation["version"]["version"]})'
+    return text
+
+def build_reverse_index(paragraphs :typing.Iterable[typing.Dict[str, str]], index_path :str):
+    """Writes a sqlite index of the reverse relationships of the given
+    Packages paragraphs to index_path. It holds
+    - "rdepends": the packages that refer to a (named) package in their
+      relationship fields, where relation is the (alternatives of the)
+      referring relation.
+    - "provides": the providers of each (virtual) package, with the provided
+      version (or null)."""
+    if os.path.exists(index_path + '.tmp'):
+        os.remove(index_path + '.tmp')
+    db = sqlite3.connect(index_path + '.tmp')
+    with db:
+        db.executescript(REVERSE_INDEX_SCHEMA)
+        for para in paragraphs:
+            pkg, version = para['Package'], para.get('Version')
+            for field in RELATION_FIELDS & para.keys():
+                for alternatives in parse_relations(para[field]):
+                    if field == 'Provides':
+                        db.executemany('INSERT INTO provides (name, package, version, provided) VALUES (?, ?, ?, ?)',
+                                       [(rel['name'], pkg, version, rel['version']['version'] if rel['version'] else None) for rel in alternatives])
+                        continue
+                    relation = ' | '.join(format_relation(rel) for rel in alternatives)
+                    db.executemany('INSERT INTO rdepends (name, package, version, field, relation) VALUES (?, ?, ?, ?, ?)',
+                                   [(name, pkg, version, field, relation) for name in dict.fromkeys(rel['name'] for rel in alternatives)])
+        db.execute('CREATE INDEX rdependsname ON rdepends (name)')
+        db.execute('CREATE INDEX providesname ON provides (name)')
+        db.execute('CREATE INDEX providespackage ON provides (package)')
+    db.close()
+    os.replace(index_path + '.tmp', index_path)
+
+def _version_order(c :str) -> int:
+    """The sort weight of a non-digit version character (or '' for the end
+    of the string): `~` sorts before anything, letters before non-letters."""
+    if c == '~':
+        return -1
+    if not c:
+        return 0
+    if c.isalpha():
+        return ord(c)
+    return ord(c) + 256
+
+def _compare_version_part(a :str, b :str) -> int:
+    """Compares upstream versions or Debian revisions like dpkg does, by
+    alternately comparing non-digit parts and (numerically) digit parts."""
+    i = j = 0
+    while i < len(a) or j < len(b):
+        while (i < len(a) and not a[i].isdigit()) or (j < len(b) and not b[j].isdigit()):
+            ac = _version_order(a[i] if i < len(a) and not a[i].isdigit() else '')
+            bc = _version_order(b[j] if j < len(b) and not b[j].isdigit() else '')
+            if ac != bc:
+                return ac - bc
+            i += 1
+            j += 1
+        start_a, start_b = i, j
+        while i < len(a) and a[i].isdigit():
+            i += 1
+        while j < len(b) and b[j].isdigit():
+            j += 1
+        diff = int(a[start_a:i] or 0) - int(b[start_b:j] or 0)
+        if diff:
+            return diff
+    return 0
+
+def compare_versions(a :str, b :str) -> int:
+    """Compares two Debian package versions ([epoch:]upstream[-revision]) as
+    dpkg does. Returns a negative number, zero or a positive number if a is
+    lower than, equal to or greater than b."""
+    def split(version):
+        epoch, _, rest = version.partition(':') if ':' in version else ('0', '', version)
+        upstream, _, revision = rest.rpartition('-') if '-' in rest else (rest, '', '')
+        return int(epoch or 0), upstream, revision
+    epoch_a, upstream_a, revision_a = split(a)
+    epoch_b, upstream_b, revision_b = split(b)
+    return (epoch_a - epoch_b) or _compare_version_part(upstream_a, upstream_b) or _compare_version_part(revision_a, revision_b)
+
+def structured(para :typing.Dict[str, str]) -> dict:
+    """Returns a copy of a paragraph with relationship fields parsed."""
+    return {field: parse_relations(value) if field in RELATION_FIELDS else value for field, value in para.items()}
+
+def paragraph_filter(conditions :typing.List[str]) -> typing.Callable[[dict], bool]:
+    """Returns a predicate for paragraphs from conditions of the form
+    FIELD=GLOB (the field value matches a shell-style pattern) or
+    FIELD~REGEX (the field value contains a match for the regex)."""
+    checks = []
+    for cond in conditions:
+        m = re.match(r'^([^=~]+)([=~])(.*)$', cond)
+        if not m:
+            raise ValueError(f'invalid condition: {cond} (expected FIELD=GLOB or FIELD~REGEX)')
+        field, op, pattern = m.groups()
+        if op == '=':
+            checks.append((field, re.compile(fnmatch.translate(pattern)).match))
+        else:
+            checks.append((field, re.compile(pattern).search))
+    return lambda para: all(field in para and match(para[field]) for field, match in checks)
 
 def file_age(path :str) -> int:
     """Returns the age of a file in seconds."""
     delta = datetime.now() - datetime.fromtimestamp(os.stat(path).st_mtime)
-    return delta.seconds
+    return int(delta.total_seconds())
+
+def cache_path(url :str) -> str:
+    """Returns the local cache path for a URL (under /tmp)."""
+    u = urlparse(url)
+    return os.path.join("/tmp", u.netloc + u.path)
+
+def file_sha256(path :str) -> str:
+    """Returns the hex SHA256 digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def apply_ed_script(lines :typing.List[bytes], script :typing.List[bytes]):
+    """Applies an ed script, as produced by `diff --ed` (and as used by
+    PDiffs), to a list of lines in place. The commands of such a script
+    address lines in descending order, so they can be applied one by one."""
+    commands = iter(script)
+    for command in commands:
+        m = re.match(rb'^(\d+)(?:,(\d+))?([acd])$', command.rstrip(b'\n'))
+        if not m:
+            if command.strip() in (b'', b'w', b'q'):
+                continue
+            raise ValueError(f'unsupported ed command: {command!r}')
+        start = int(m.group(1))
+        end = int(m.group(2) or start)
+        text = []
+        if m.group(3) in (b'a', b'c'):
+            for line in commands:
+                if line.rstrip(b'\n') == b'.':
+                    break
+                text.append(line)
+        if m.group(3) == b'a':
+            lines[start:start] = text
+        else:
+            lines[start - 1:end] = text
+
+def open_compressed(path :str, mode :str='rb') -> typing.IO:
+    """Opens a (possibly) compressed index file, judging by its suffix."""
+    for suffix, opener in COMPRESSIONS.items():
+        if suffix and path.endswith(suffix):
+            return opener(path, mode)
+    return open(path, mode)
+
+def build_packages_index(compressed_path :str, packages_path :str, index_path :str) -> str:
+    """Decompresses a Packages(.xz|.bz2|.gz) file to packages_path and writes
+    a sidecar index to index_path. The index is a JSON object that maps each package
+    name to the [offset, length] of its paragraph(s) in the decompressed
+    file, so that a paragraph can be read with a single seek. Returns the
+    SHA256 digest of the decompressed file."""
+    index = {}
+    digest = hashlib.sha256()
+    with open_compressed(compressed_path) as src, open(packages_path + '.tmp', 'wb') as dst:
+        offset = 0
+        start = 0
+        name = None
+        for line in src:
+            dst.write(line)
+            digest.update(line)
+            if not line.strip():
+                if name is not None:
+                    index.setdefault(name, []).append([start, offset - start])
+                name = None
+                start = offset + len(line)
+            elif line.startswith(b'Package:'):
+                name = line[len(b'Package:'):].strip().decode('utf-8')
+            offset += len(line)
+        if name is not None:
+            index.setdefault(name, []).append([start, offset - start])
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.replace(packages_path + '.tmp', packages_path)
+    os.replace(index_path + '.tmp', index_path)
+    return digest.hexdigest()
+
+class Release:
+    """The (parsed) Release file of a distribution."""
+    def __init__(self, text :str):
+        self.fields = next(iter_paragraphs(StringIO(text)), {})
+        self.components = self.fields.get('Components', '').split()
+        self.architectures = self.fields.get('Architectures', '').split()
+        # path (relative to the dist directory) -> (sha256, size)
+        self.files = {}
+        for line in self.fields.get('SHA256', '').splitlines():
+            parts = line.split()
+            if len(parts) == 3:
+                self.files[parts[2]] = (parts[0], int(parts[1]))
+
+    def variants(self, path :str) -> typing.List[str]:
+        """Returns the supported variants of an index file (such as
+        `main/binary-amd64/Packages`) that the Release file lists, compressed
+        ones first (smallest first). Archives tend to list the uncompressed
+        file without serving it, so that one comes last."""
+        compressed = sorted((self.files[path + suffix][1], path + suffix) for suffix in COMPRESSIONS if suffix and path + suffix in self.files)
+        return [variant for _, variant in compressed] + ([path] if path in self.files else [])
+
+    def smallest_variant(self, path :str) -> typing.Optional[str]:
+        """Returns the preferred (see variants) variant of an index file that
+        the Release file lists, or None if it lists none of them."""
+        return next(iter(self.variants(path)), None)
 
 class Archive:
-    def __init__(self, repo, dist, component, arch, max_cache_age:int=3600):
+    def __init__(self, repo, dist, component, arch, max_cache_age:int=3600, release :Release=None, pdiffs :bool=True):
         """Initialize an Archive.
 
-        :keyword max_cache_age: If an already downloaded Packages.gz/Sources.gz
-          file is found older than this, it will be downloaded anew.
+        :keyword max_cache_age: If an already downloaded Release/Sources.gz
+          file is found older than this, it will be revalidated/downloaded
+          anew. (The Packages file is kept in sync with the Release file.)
+        :keyword release: The Release file of the distribution. If not given,
+          it is fetched when needed.
+        :keyword pdiffs: Whether to update the cached Packages file with
+          PDiffs (Packages.diff/Index), when the archive offers them.
         """
         self.repo = repo.strip('/')
         self.dist = dist.strip('/')
         self.component = component.strip('/')
         self.arch = arch.strip('/')
         self.max_cache_age = max_cache_age
+        self.release = release
+        self.pdiffs = pdiffs
+
+    def packages_name(self):
+        """Path of the Packages file relative to the dist directory (as in the Release file)."""
+        return f'{self.component}/binary-{self.arch}/Packages'
 
     def packages_url(self):
-        return f'{self.repo}/dists/{self.dist}/{self.component}/binary-{self.arch}/Packages.gz'
+        packages = self.packages_name()
+        if self.release:
+            packages = self.release.smallest_variant(packages) or packages + '.gz'
+        else:
+            packages += '.gz'
+        return f'{self._dist_url()}/{packages}'
 
     def sources_url(self):
         return f'{self.repo}/dists/{self.dist}/{self.component}/source/Sources.gz'
 
     def packages_cache_path(self):
-        scheme = urlparse(self.packages_url()).scheme + "://"
-        path = self.packages_url().lstrip(scheme)
-        return os.path.join("/tmp", path)
+        return cache_path(self.packages_url())
+
+    def packages_file_path(self):
+        """Path of the decompressed Packages file (next to the cached Packages.gz)."""
+        return os.path.join(os.path.dirname(self.packages_cache_path()), 'Packages')
+
+    def packages_index_path(self):
+        """Path of the package name index of the decompressed Packages file."""
+        return self.packages_file_path() + '.idx'
+
+    def packages_rdeps_path(self):
+        """Path of the reverse relationship index of the decompressed Packages file."""
+        return self.packages_file_path() + '.rdeps.sqlite'
+
+    def packages_state_path(self):
+        """Path of the record of the checksums that the cached Packages file was built from."""
+        return self.packages_file_path() + '.state'
 
     def sources_cache_path(self):
-        scheme = urlparse(self.sources_url()).scheme + "://"
-        path = self.packages_url().lstrip(scheme)
-        return os.path.join("/tmp", path)
+        return cache_path(self.sources_url())
 
     def get_release_components(self):
-        body = self._get(self._releases_url(), )
-        for line in body.split("\n"):
-            if line.startswith("Components: "):
-                return line.split(":")[1].strip()
+        return ' '.join(self.get_release().components)
+
+    def get_release(self) -> Release:
+        """Returns the Release file. The cached copy is revalidated (with
+        If-Modified-Since) once it is older than max_cache_age."""
+        if self.release is None:
+            path = cache_path(self._releases_url())
+            if not os.path.isfile(path) or file_age(path) >= self.max_cache_age:
+                self._revalidate(self._releases_url(), path)
+            else:
+                LOG.debug("reusing cached %s (age: %d seconds)", path, file_age(path))
+            with open(path, encoding='utf-8') as f:
+                self.release = Release(f.read())
+        return self.release
+
+    def _dist_url(self):
+        return f'{self.repo}/dists/{self.dist}'
 
     def _releases_url(self):
-        return f'{self.repo}/dists/{self.dist}/Release'
+        return f'{self._dist_url()}/Release'
 
     def _get(self, url:str):
         LOG.debug("GETing %s ...", url)
-        u = urlparse(url)
-        conn = self._connect(u)
-        try:
-            conn.request("GET", u.path)
-            resp = conn.getresponse()
-            if not resp.status == 200:
-                if resp.status in [301,302]:
-                    redirect_url = str(resp.getheader('location'))
-                    return self._get(redirect_url)
-                raise ValueError(f'http error: {resp.status}')
+        with self._request(url) as resp:
             return resp.read().decode("utf-8")
-        finally:
-            conn.close()
 
-    def _download_to(self, url:str, dest_path:str):
+    def _download_to(self, url:str, dest_path:str, headers :dict=None) -> typing.Optional[http.client.HTTPMessage]:
+        """Downloads url to dest_path and returns the response headers, or None
+        (leaving dest_path as is) if the server answers a conditional request
+        with 304 Not Modified."""
         LOG.debug("downloading %s to %s ...", url, dest_path)
         path_dir = os.path.dirname(dest_path)
         if path_dir:
             os.makedirs(path_dir, exist_ok=True)
+        with self._request(url, headers) as src:
+            if src.status == 304:
+                src.read()
+                return None
+            with open(dest_path + '.tmp', "wb") as dst:
+                shutil.copyfileobj(src, dst)
+        os.replace(dest_path + '.tmp', dest_path)
+        return src.headers
+
+    def _revalidate(self, url:str, path:str):
+        """Downloads url to path, unless the server reports (via
+        If-Modified-Since, with the Last-Modified time that it gave for the
+        cached copy) that the cached copy is still current."""
+        headers = {}
+        if os.path.isfile(path) and os.path.isfile(path + '.last-modified'):
+            with open(path + '.last-modified') as f:
+                headers['If-Modified-Since'] = f.read().strip()
+        response_headers = self._download_to(url, path, headers)
+        if response_headers is None:
+            LOG.debug("%s not modified", url)
+            os.utime(path)
+        elif response_headers.get('Last-Modified'):
+            with open(path + '.last-modified', 'w') as f:
+                f.write(response_headers['Last-Modified'])
+        elif os.path.isfile(path + '.last-modified'):
+            os.remove(path + '.last-modified')
+
+    def _fetch_verified(self, path:str, dest_path:str, sha256:str, size:int, by_hash:bool=False):
+        """Downloads a file of the dist directory (such as
+        `main/binary-amd64/Packages.xz`) to dest_path and verifies its
+        checksum and size. With by_hash, the file is fetched from its
+        by-hash path (if the Release file says that the archive has those)."""
+        url = f'{self._dist_url()}/{path}'
+        if by_hash and self.get_release().fields.get('Acquire-By-Hash', '').lower() == 'yes':
+            url = f'{self._dist_url()}/{os.path.dirname(path)}/by-hash/SHA256/{sha256}'
+        self._download_to(url, dest_path)
+        if os.path.getsize(dest_path) != size or file_sha256(dest_path) != sha256:
+            os.remove(dest_path)
+            raise ValueError(f'checksum mismatch: {url}')
+
+    def _request(self, url:str, headers :dict=None) -> http.client.HTTPResponse:
+        """Sends a GET request over the calling thread's keep-alive connection
+        to the host (following redirects) and returns the 200 (or, to a
+        conditional request, 304) response, which must be read to the end
+        before the connection is used again."""
         u = urlparse(url)
-        conn = self._connect(u)
-        try:
-            conn.request("GET", u.path)
-            resp = conn.getresponse()
-            if not resp.status == 200:
-                if resp.status in [301,302]:
-                    redirect_url = str(resp.getheader('location'))
-                    self._download_to(redirect_url, dest_path)
-                    return
-                raise ValueError(f'http error: {resp.status}')
-            with resp as src:
-                with open(dest_path, "wb") as dst:
-                    shutil.copyfileobj(src, dst)
-        finally:
-            conn.close()
+        for attempt in range(2):
+            conn = self._connect(u)
+            try:
+                conn.request("GET", u.path, headers=headers or {})
+                resp = conn.getresponse()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # the server may have closed an idle keep-alive connection
+                self._disconnect(u)
+                if attempt:
+                    raise
+        if not (resp.status == 200 or (resp.status == 304 and headers)):
+            resp.read()
+            if resp.status in [301,302]:
+                redirect_url = urljoin(url, str(resp.getheader('location')))
+                return self._request(redirect_url, headers)
+            raise ValueError(f'http error: {resp.status}')
+        return resp
 
     def _connect(self, url):
-        if url.scheme == 'http':
-            conn = http.client.HTTPConnection(url.netloc)
-        else:
-            conn = http.client.HTTPSConnection(url.netloc)
-        return conn
+        conns = CONNECTIONS.__dict__.setdefault('conns', {})
+        key = (url.scheme, url.netloc)
+        if key not in conns:
+            if url.scheme == 'http':
+                conns[key] = http.client.HTTPConnection(url.netloc)
+            else:
+                conns[key] = http.client.HTTPSConnection(url.netloc)
+        return conns[key]
 
+    def _disconnect(self, url):
+        conn = CONNECTIONS.__dict__.get('conns', {}).pop((url.scheme, url.netloc), None)
+        if conn:
+            conn.close()
 
     def download_packages(self, dest_path :str):
         self._download_to(self.packages_url(), dest_path)
@@ -127,45 +486,225 @@ class Archive:
         self._download_to(self.sources_url(), dest_path)
 
     def list_packages(self):
-        pkgs_file = self._update_packages_cache()
-        pkgs = []
-        with gzip.open(pkgs_file, mode='rt', encoding='utf-8') as f:
-            while True:
-                line = read_to(f, '^Package: ')
-                if line is None:
-                    break
-                pkg_name = re.match(r'^Package: (.*)$', line)[1]
-                line = read_to(f, '^Version: ')
-                if line is None:
-                    break
-                pkg_version = re.match(r'^Version: (.*)$', line)[1]
-                pkgs.append(f'{pkg_name}@{pkg_version}')
-            return pkgs
+        return [f'{para["Package"]}@{para.get("Version")}' for para in self.iter_packages()]
+
+    def iter_packages(self) -> typing.Iterator[typing.Dict[str, str]]:
+        """Yields each paragraph of the Packages file."""
+        with open(self._update_packages_cache(), mode='rt', encoding='utf-8') as f:
+            yield from iter_paragraphs(f)
+
+    def iter_sources(self) -> typing.Iterator[typing.Dict[str, str]]:
+        """Yields each paragraph of the Sources file."""
+        with gzip.open(self._update_sources_cache(), mode='rt', encoding='utf-8') as f:
+            yield from iter_paragraphs(f)
+
+    def _update_sources_cache(self) -> str:
+        srcs_file = self.sources_cache_path()
+        if not os.path.isfile(srcs_file) or (file_age(srcs_file) > self.max_cache_age):
+            LOG.debug("downloading new Sources.gz file to %s", srcs_file)
+            self.download_sources(srcs_file)
+        else:
+            LOG.debug("reusing cached %s (age: %d seconds)", srcs_file, file_age(srcs_file))
+        return srcs_file
 
     def _update_packages_cache(self) -> str:
+        """Makes sure that an up-to-date Packages file and its index are
+        cached and returns the path of the (decompressed) Packages file.
+
+        Up-to-date means that the cached file matches the checksum of the
+        Release file. A changed Packages file is brought up-to-date with
+        PDiffs where possible, or else its smallest variant is downloaded
+        (from its by-hash path) into a content-addressed cache. Should that
+        variant not be served, the next one is tried."""
+        release = self.get_release()
+        name = self.packages_name()
+        variants = release.variants(name)
+        if not variants:
+            LOG.debug("%s not listed in the Release file: going by cache age", name)
+            return self._update_packages_cache_by_age()
+
+        pkgs_file = self.packages_file_path()
+        state = self._packages_state()
+        if name in release.files:
+            current = state.get('sha256') == release.files[name][0]
+        else:
+            current = state.get('source') in release.files and state.get('source_sha256') == release.files[state['source']][0]
+        if current and os.path.isfile(pkgs_file):
+            LOG.debug("reusing cached %s (checksum unchanged)", pkgs_file)
+            if not os.path.isfile(self.packages_index_path()):
+                self._index = None
+                build_packages_index(pkgs_file, pkgs_file, self.packages_index_path())
+            return pkgs_file
+
+        if self.pdiffs and state.get('sha256') and os.path.isfile(pkgs_file) and f'{name}.diff/Index' in release.files:
+            try:
+                self._apply_pdiffs(state['sha256'], variants[0])
+                return pkgs_file
+            except (ValueError, OSError, http.client.HTTPException) as e:
+                LOG.info("not updating %s with pdiffs: %s", pkgs_file, e)
+
+        by_hash_dir = os.path.join(os.path.dirname(pkgs_file), 'by-hash', 'SHA256')
+        for i, variant in enumerate(variants):
+            sha256, size = release.files[variant]
+            download = os.path.join(by_hash_dir, sha256 + os.path.splitext(variant)[1])
+            if os.path.isfile(download) and file_sha256(download) == sha256:
+                break
+            LOG.debug("downloading %s to %s", variant, download)
+            try:
+                self._fetch_verified(variant, download, sha256, size, by_hash=True)
+                break
+            except ValueError as e:
+                if i == len(variants) - 1:
+                    raise
+                LOG.info("cannot fetch %s (%s), trying %s ...", variant, e, variants[i + 1])
+        LOG.debug("indexing %s ...", download)
+        self._index = None
+        digest = build_packages_index(download, pkgs_file, self.packages_index_path())
+        if name in release.files and digest != release.files[name][0]:
+            raise ValueError(f'checksum mismatch: decompressed {variant}')
+        self._save_packages_state({'source': variant, 'source_sha256': sha256, 'sha256': digest})
+        self._prune_by_hash(keep=download)
+        return pkgs_file
+
+    def _prune_by_hash(self, keep :str=None):
+        """Removes the downloads (other than keep) that the cached Packages file is no longer built from."""
+        by_hash_dir = os.path.join(os.path.dirname(self.packages_file_path()), 'by-hash', 'SHA256')
+        if os.path.isdir(by_hash_dir):
+            for entry in os.listdir(by_hash_dir):
+                if os.path.join(by_hash_dir, entry) != keep:
+                    os.remove(os.path.join(by_hash_dir, entry))
+
+    def _apply_pdiffs(self, sha256 :str, variant :str):
+        """Brings the cached Packages file (with checksum sha256) up-to-date by
+        applying the PDiffs (ed scripts) of Packages.diff/Index in order and
+        verifies the result against the Release file."""
+        name = self.packages_name()
+        release = self.get_release()
+        if name not in release.files:
+            raise ValueError(f'{name} is not listed in the Release file: cannot verify pdiffs')
+        diff_dir = os.path.join(os.path.dirname(self.packages_file_path()), 'Packages.diff')
+        index_path = os.path.join(diff_dir, 'Index')
+        self._fetch_verified(f'{name}.diff/Index', index_path, *release.files[f'{name}.diff/Index'], by_hash=True)
+        with open(index_path, encoding='utf-8') as f:
+            index = next(iter_paragraphs(f), {})
+
+        def entries(field):
+            return [line.split() for line in index.get(field, '').splitlines() if len(line.split()) == 3]
+        history = entries('SHA256-History')
+        patches = {patch: (digest, int(size)) for digest, size, patch in entries('SHA256-Patches')}
+        downloads = {patch: (digest, int(size)) for digest, size, patch in entries('SHA256-Download')}
+        if index.get('SHA256-Current', '').split()[:1] != [release.files[name][0]]:
+            raise ValueError('Packages.diff/Index does not match the Release file')
+        start = next((i for i, (digest, _, _) in enumerate(history) if digest == sha256), None)
+        if start is None:
+            raise ValueError('no pdiffs apply to the cached file')
+        names = [patch for _, _, patch in history[start:]]
+        if index.get('X-Patch-Precedence') == 'merged':
+            names = names[:1]
+        if any(patch not in patches or patch + '.gz' not in downloads for patch in names):
+            raise ValueError('incomplete Packages.diff/Index')
+        if sum(downloads[patch + '.gz'][1] for patch in names) >= release.files[variant][1]:
+            raise ValueError(f'pdiffs are larger than {variant}')
+
+        with open(self.packages_file_path(), 'rb') as f:
+            lines = f.readlines()
+        for patch in names:
+            LOG.debug("applying pdiff %s ...", patch)
+            patch_path = os.path.join(diff_dir, patch + '.gz')
+            self._fetch_verified(f'{name}.diff/{patch}.gz', patch_path, *downloads[patch + '.gz'])
+            with gzip.open(patch_path, 'rb') as f:
+                script = f.read()
+            os.remove(patch_path)
+            if hashlib.sha256(script).hexdigest() != patches[patch][0]:
+                raise ValueError(f'checksum mismatch: pdiff {patch}')
+            apply_ed_script(lines, script.splitlines(keepends=True))
+        patched = self.packages_file_path() + '.patched'
+        with open(patched, 'wb') as f:
+            f.writelines(lines)
+        self._index = None
+        digest = build_packages_index(patched, self.packages_file_path(), self.packages_index_path())
+        os.remove(patched)
+        if digest != release.files[name][0]:
+            self._save_packages_state({})
+            raise ValueError('checksum mismatch: patched Packages file')
+        self._save_packages_state({'sha256': digest})
+        self._prune_by_hash()
+
+    def _packages_state(self) -> dict:
+        try:
+            with open(self.packages_state_path()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_packages_state(self, state :dict):
+        with open(self.packages_state_path() + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(self.packages_state_path() + '.tmp', self.packages_state_path())
+
+    def _update_packages_cache_by_age(self) -> str:
         pkgs_file = self.packages_cache_path()
         if not os.path.isfile(pkgs_file) or (file_age(pkgs_file) > self.max_cache_age):
-            LOG.debug("downloading new Packages.gz file to %s", pkgs_file)
+            LOG.debug("downloading new Packages file to %s", pkgs_file)
             self.download_packages(pkgs_file)
+            self._build_packages_index()
         else:
             LOG.debug("reusing cached %s (age: %d seconds)", pkgs_file, file_age(pkgs_file))
-        return pkgs_file
+            if not os.path.isfile(self.packages_index_path()):
+                self._build_packages_index()
+        return self.packages_file_path()
 
-    def get_pkg_paragraph(self, pkg :str) -> str:
+    def _build_packages_index(self):
+        self._index = None
+        LOG.debug("indexing %s ...", self.packages_cache_path())
+        build_packages_index(self.packages_cache_path(), self.packages_file_path(), self.packages_index_path())
+
+    def get_pkg_paragraphs(self, pkgs :typing.List[str]) -> typing.List[str]:
+        """Returns the (first) paragraph of each of the given packages, read
+        from the decompressed Packages file via its index."""
         pkgs_file = self._update_packages_cache()
+        index = self._packages_index()
 
-        buf = StringIO()
-        with gzip.open(pkgs_file, mode='rt', encoding='utf-8') as f:
-            line = read_to(f, f'^Package: {pkg}$')
-            if line is None:
-                raise ValueError(f'no such package: {pkg}')
-            buf.write(line)
-            for line in f:
-                if not line.strip():
-                    break
-                buf.write(line)
+        paragraphs = []
+        with open(pkgs_file, 'rb') as f:
+            for pkg in pkgs:
+                if pkg not in index:
+                    raise ValueError(f'no such package: {pkg}')
+                offset, length = index[pkg][0]
+                f.seek(offset)
+                paragraphs.append(f.read(length).decode('utf-8'))
+        return paragraphs
 
-        return buf.getvalue()
+    def has_package(self, pkg :str) -> bool:
+        self._update_packages_cache()
+        return pkg in self._packages_index()
+
+    def _packages_index(self) -> typing.Dict[str, list]:
+        """Returns the (once loaded) package name index."""
+        if getattr(self, '_index', None) is None:
+            with open(self.packages_index_path()) as f:
+                self._index = json.load(f)
+        return self._index
+
+    def update_reverse_index(self) -> str:
+        """Makes sure that the reverse relationship index (see
+        build_reverse_index) of the Packages file is up-to-date, (re)building
+        it if it is older than the file, and returns its path."""
+        pkgs_file = self._update_packages_cache()
+        rdeps_file = self.packages_rdeps_path()
+        if not os.path.isfile(rdeps_file) or os.stat(rdeps_file).st_mtime < os.stat(pkgs_file).st_mtime:
+            LOG.debug("building reverse relationship index %s ...", rdeps_file)
+            build_reverse_index(self.iter_packages(), rdeps_file)
+        return rdeps_file
+
+    def reverse_index(self) -> sqlite3.Connection:
+        """Returns a connection to the up-to-date reverse relationship index."""
+        if getattr(self, '_rdeps_db', None) is None:
+            self._rdeps_db = sqlite3.connect(self.update_reverse_index())
+        return self._rdeps_db
+
+    def get_pkg_paragraph(self, pkg :str) -> str:
+        return self.get_pkg_paragraphs([pkg])[0]
 
 def download_packages_file(args):
     """Implementation of the `download-packages-file` subcommand."""
@@ -183,15 +722,203 @@ def components(args):
     archive = Archive(repo=args.repo, dist=args.dist, component=args.component, arch=args.arch, max_cache_age=args.max_cache_age)
     print(archive.get_release_components())
 
+def archives(args, repo :str=None, dist :str=None) -> typing.List[Archive]:
+    """Returns an Archive for each of the requested component/arch
+    combinations (of args.repo and args.dist, unless overridden). Whenever
+    more than one combination is requested (or `*`), the Release file is
+    fetched once to expand `*` and to pick the smallest Packages file
+    variant of each archive."""
+    repo = repo or args.repo
+    dist = dist or args.dist
+    components = args.component.split(',')
+    archs = args.arch.split(',')
+    release = None
+    if len(components) > 1 or len(archs) > 1 or '*' in components + archs:
+        release = Archive(repo, dist, components[0], archs[0], max_cache_age=args.max_cache_age).get_release()
+        if '*' in components:
+            components = release.components
+        if '*' in archs:
+            archs = release.architectures
+    result = []
+    for component in components:
+        for arch in archs:
+            if release and release.files and not release.smallest_variant(f'{component}/binary-{arch}/Packages'):
+                LOG.warning("skipping %s/binary-%s: not listed in the Release file", component, arch)
+                continue
+            result.append(Archive(repo=repo, dist=dist, component=component, arch=arch, max_cache_age=args.max_cache_age, release=release, pdiffs=args.pdiffs))
+    return result
+
+def update_caches(archives :typing.List[Archive], workers :int):
+    """Concurrently brings the Packages cache of each archive up-to-date."""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda archive: archive._update_packages_cache(), archives))
+
 def list_packages(args):
     """Implementation of the `list-packages` subcommand."""
-    archive = Archive(repo=args.repo, dist=args.dist, component=args.component, arch=args.arch, max_cache_age=args.max_cache_age)
-    print(json.dumps(archive.list_packages(), indent=2))
+    archs = archives(args)
+    update_caches(archs, args.workers)
+    # architecture-independent packages occur in the archive of every arch
+    packages = {pkg: None for archive in archs for pkg in archive.list_packages()}
+    print(json.dumps(list(packages), indent=2))
+
+def query(args):
+    """Implementation of the `query` subcommand."""
+    archs = archives(args)
+    matches = paragraph_filter(args.where)
+    fields = args.fields.split(',') if args.fields else None
+    if args.sources:
+        # sources are not per-arch: one archive per component suffices
+        archs = list({archive.component: archive for archive in archs}.values())
+    else:
+        update_caches(archs, args.workers)
+    for archive in archs:
+        paragraphs = archive.iter_sources() if args.sources else archive.iter_packages()
+        for para in paragraphs:
+            if not matches(para):
+                continue
+            if fields:
+                para = {field: para[field] for field in fields if field in para}
+            print(json.dumps(para if args.raw else structured(para)))
 
 def show_package(args):
     """Implementation of the `show-package` subcommand."""
-    archive = Archive(repo=args.repo, dist=args.dist, component=args.component, arch=args.arch, max_cache_age=args.max_cache_age)
-    print(archive.get_pkg_paragraph(args.package))
+    archs = archives(args)
+    update_caches(archs, args.workers)
+    paragraphs = []
+    for pkg in args.package:
+        found = [para for archive in archs if archive.has_package(pkg) for para in archive.get_pkg_paragraphs([pkg])]
+        if not found:
+            raise ValueError(f'no such package: {pkg}')
+        # architecture-independent packages occur in the archive of every arch
+        paragraphs.extend(dict.fromkeys(found))
+    print('\n'.join(paragraphs))
+
+class ReverseIndex:
+    """Name lookups in the reverse relationship indices of several archives."""
+    def __init__(self, dbs :typing.List[sqlite3.Connection]):
+        self.dbs = dbs
+
+    def _query(self, sql :str, params :tuple) -> typing.List[tuple]:
+        rows = [row for db in self.dbs for row in db.execute(sql, params)]
+        if len(self.dbs) > 1:
+            # architecture-independent packages occur in the archive of every arch
+            rows = list(dict.fromkeys(rows))
+        return rows
+
+    def rdepends(self, name :str) -> typing.List[tuple]:
+        """Returns the (package, version, field, relation) that refer to a name."""
+        return self._query('SELECT package, version, field, relation FROM rdepends WHERE name = ? ORDER BY rowid', (name,))
+
+    def providers(self, name :str) -> typing.List[tuple]:
+        """Returns the (package, version, provided version) that provide a name."""
+        return self._query('SELECT package, version, provided FROM provides WHERE name = ? ORDER BY rowid', (name,))
+
+    def provided_by(self, pkg :str) -> typing.List[str]:
+        """Returns the (virtual package) names that a package provides."""
+        return list(dict.fromkeys(name for (name,) in self._query('SELECT name FROM provides WHERE package = ? ORDER BY rowid', (pkg,))))
+
+def reverse_index(archs :typing.List[Archive], workers :int) -> ReverseIndex:
+    """Concurrently brings the reverse relationship index of each archive
+    up-to-date and returns them for lookups."""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda archive: archive.update_reverse_index(), archs))
+    return ReverseIndex([archive.reverse_index() for archive in archs])
+
+def rdepends(args):
+    """Implementation of the `rdepends` subcommand."""
+    index = reverse_index(archives(args), args.workers)
+    types = set(args.types.split(','))
+
+    def dependents(pkg):
+        # a package is also depended on via the virtual packages it provides
+        for name in [pkg] + index.provided_by(pkg):
+            for dependent, version, field, relation in index.rdepends(name):
+                if field in types:
+                    yield {'package': dependent, 'version': version, 'field': field, 'relation': relation, 'on': pkg}
+
+    result = []
+    seen = set(args.package)
+    queue = deque(args.package)
+    while queue:
+        pkg = queue.popleft()
+        for dep in dependents(pkg):
+            if args.transitive:
+                if dep['package'] in seen:
+                    continue
+                seen.add(dep['package'])
+                queue.append(dep['package'])
+            result.append(dep)
+    print(json.dumps(result, indent=2))
+
+def whatprovides(args):
+    """Implementation of the `whatprovides` subcommand."""
+    index = reverse_index(archives(args), args.workers)
+    providers = []
+    for name in args.name:
+        providers += [{'package': pkg, 'version': version, 'provides': name, 'provided_version': provided}
+                      for pkg, version, provided in index.providers(name)]
+    print(json.dumps(providers, indent=2))
+
+def name_versions(archive :Archive) -> typing.Iterator[typing.Tuple[str, str]]:
+    """Yields the (name, version) of each package of an archive in name order.
+    These are streamed from the Packages file if it is sorted by name (as it
+    usually is), else they are sorted in memory."""
+    pkgs_file = archive._update_packages_cache()
+    in_order = True
+    with open(pkgs_file, 'rb') as f:
+        previous = b''
+        for line in f:
+            if line.startswith(b'Package:'):
+                name = line[len(b'Package:'):].strip()
+                if name < previous:
+                    in_order = False
+                    break
+                previous = name
+    pairs = ((para['Package'], para.get('Version', '')) for para in archive.iter_packages())
+    if not in_order:
+        LOG.debug("%s is not sorted by package name: sorting it in memory", pkgs_file)
+        pairs = iter(sorted(pairs, key=lambda pair: pair[0].encode('utf-8')))
+    return pairs
+
+def newest_versions(archs :typing.List[Archive]) -> typing.Iterator[typing.Tuple[str, str]]:
+    """Yields the (name, highest version) of each package of several archives
+    in name order, by merging their name-ordered package streams."""
+    merged = heapq.merge(*[name_versions(archive) for archive in archs], key=lambda pair: pair[0].encode('utf-8'))
+    current = None
+    for name, version in merged:
+        if current and current[0] == name:
+            if compare_versions(version, current[1]) > 0:
+                current = (name, version)
+            continue
+        if current:
+            yield current
+        current = (name, version)
+    if current:
+        yield current
+
+def diff(args):
+    """Implementation of the `diff` subcommand."""
+    old_archs = archives(args)
+    new_archs = archives(args, repo=args.other_repo, dist=args.other_dist)
+    update_caches(old_archs + new_archs, args.workers)
+    end = (None, None)
+    old, new = newest_versions(old_archs), newest_versions(new_archs)
+    (old_name, old_version), (new_name, new_version) = next(old, end), next(new, end)
+    # merge-join on package name
+    while old_name is not None or new_name is not None:
+        if new_name is None or (old_name is not None and old_name.encode('utf-8') < new_name.encode('utf-8')):
+            change = {'package': old_name, 'change': 'removed', 'old': old_version, 'new': None}
+            old_name, old_version = next(old, end)
+        elif old_name is None or old_name != new_name:
+            change = {'package': new_name, 'change': 'added', 'old': None, 'new': new_version}
+            new_name, new_version = next(new, end)
+        else:
+            order = compare_versions(new_version, old_version)
+            change = {'package': new_name, 'change': 'upgraded' if order > 0 else 'downgraded' if order < 0 else 'unchanged',
+                      'old': old_version, 'new': new_version}
+            (old_name, old_version), (new_name, new_version) = next(old, end), next(new, end)
+        if change['change'] in args.changes:
+            print(json.dumps(change))
 
 
 DESCRIPTION="""
@@ -210,6 +937,18 @@ Examples:
     apt-inspect.py --repo=http://packages.microsoft.com/repos/code --dist=stable --component=main --arch=arm64 list-packages
 
     apt-inspect.py --repo=http://packages.microsoft.com/repos/code --dist=stable --component=main --arch=arm64 show-package curl
+
+    # packages of several components and architectures (fetched concurrently)
+    apt-inspect.py --dist=bookworm --component=main,contrib --arch='*' list-packages
+
+    # what (transitively) depends on libssl3, and what provides mail-transport-agent
+    apt-inspect.py --dist=bookworm rdepends --transitive libssl3
+    apt-inspect.py --dist=bookworm whatprovides mail-transport-agent
+
+    # packages added, removed, upgraded or downgraded between two releases
+    apt-inspect.py --repo=http://archive.ubuntu.com/ubuntu --dist=focal diff jammy
+
+    apt-inspect.py --dist=bookworm query --where 'Section=python' --where 'Depends~libssl' --fields Package,Version,Depends
 """
 
 class MyHelpFormatter(argparse.ArgumentDefaultsHelpFormatter,argparse.RawTextHelpFormatter):
@@ -221,10 +960,12 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=DESCRIPTION, formatter_class=MyHelpFormatter)
     parser.add_argument("--repo", default="https://ftp.debian.org/debian", help="APT repository such as `http://se.archive.ubuntu.com/ubuntu`.")
     parser.add_argument("--dist", default="stable", help="Distribution. For example `focal`, `stable` or `buster`.")
-    parser.add_argument("--component", default="main", help="Release component. For example, `main`, `contrib`, `non-free`.")
-    parser.add_argument("--arch", default="amd64", help="Architecture (only relevant for binary packages). For example `i386`, `amd64`.")
+    parser.add_argument("--component", default="main", help="Release component. For example, `main`, `contrib`, `non-free`. The list-packages, show-package and query subcommands accept a comma-separated list or `*` (every component of the Release file).")
+    parser.add_argument("--arch", default="amd64", help="Architecture (only relevant for binary packages). For example `i386`, `amd64`. The list-packages, show-package and query subcommands accept a comma-separated list or `*` (every architecture of the Release file). Note that `all` is the architecture of architecture-independent packages.")
+    parser.add_argument("--workers", type=int, default=4, help="Number of Packages files to fetch concurrently.")
     parser.add_argument("--verbose", action='store_true', default=False, help="Print body in error responses.")
-    parser.add_argument("--max-cache-age", type=int, default=86400, help="Max cache age in seconds.")
+    parser.add_argument("--max-cache-age", type=int, default=86400, help="Max cache age in seconds (after which a cached Release or Sources.gz file is revalidated/downloaded anew).")
+    parser.add_argument("--no-pdiffs", dest="pdiffs", action="store_false", default=True, help="Do not update cached Packages files with PDiffs (Packages.diff/Index).")
 
     subparsers = parser.add_subparsers(help="subcommands")
 
@@ -239,10 +980,34 @@ if __name__ == "__main__":
     list_packages_cmd = subparsers.add_parser("list-packages", help="List all packages found in the Packages.gz archive")
     list_packages_cmd.set_defaults(action=list_packages)
 
-    show_package_cmd = subparsers.add_parser("show-package", help="Show a particular package found in the Packages.gz archive")
-    show_package_cmd.add_argument("package", help="Package name")
+    show_package_cmd = subparsers.add_parser("show-package", help="Show particular packages found in the Packages.gz archive")
+    show_package_cmd.add_argument("package", nargs="+", help="Package name (option can occur multiple times)")
     show_package_cmd.set_defaults(action=show_package)
 
+    query_cmd = subparsers.add_parser("query", help="Output the (matching) package records of the archive as JSON lines")
+    query_cmd.add_argument("--where", action="append", default=[],
+                           help="Only records where FIELD=GLOB (shell-style pattern match) or FIELD~REGEX (regex search). For example `Section=libs` or `Depends~libssl`. Option can occur multiple times.")
+    query_cmd.add_argument("--fields", help="Comma-separated list of fields to output. For example `Package,Version,Depends`.")
+    query_cmd.add_argument("--sources", action="store_true", default=False, help="Query Sources.gz rather than Packages.gz.")
+    query_cmd.add_argument("--raw", action="store_true", default=False, help="Output relationship fields (such as Depends) as is rather than parsed.")
+    query_cmd.set_defaults(action=query)
+
+    rdepends_cmd = subparsers.add_parser("rdepends", help="Show the packages that depend on particular packages (directly or via packages that they provide)")
+    rdepends_cmd.add_argument("package", nargs="+", help="Package name (option can occur multiple times)")
+    rdepends_cmd.add_argument("--types", default="Depends,Pre-Depends,Recommends", help="Comma-separated list of relationship fields to follow. For example `Depends,Suggests,Breaks`.")
+    rdepends_cmd.add_argument("--transitive", action="store_true", default=False, help="Also show the packages that (transitively) depend on the dependent packages.")
+    rdepends_cmd.set_defaults(action=rdepends)
+
+    whatprovides_cmd = subparsers.add_parser("whatprovides", help="Show the packages that provide particular (virtual) packages")
+    whatprovides_cmd.add_argument("name", nargs="+", help="(Virtual) package name (option can occur multiple times)")
+    whatprovides_cmd.set_defaults(action=whatprovides)
+
+    diff_cmd = subparsers.add_parser("diff", help="Compare the package versions of --dist with those of another dist (as JSON lines)")
+    diff_cmd.add_argument("other_dist", help="Distribution to compare with. For example `jammy`.")
+    diff_cmd.add_argument("--other-repo", help="APT repository of the other distribution (if it is not --repo).")
+    diff_cmd.add_argument("--changes", type=lambda value: value.split(','), default="added,removed,upgraded,downgraded", help="Comma-separated list of changes to output: added, removed, upgraded, downgraded and/or unchanged.")
+    diff_cmd.set_defaults(action=diff)
+
     components_cmd = subparsers.add_parser("components", help="Discover release components for a particular repo+distro.")
     components_cmd.set_defaults(action=components)
 
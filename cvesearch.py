@@ -1,11 +1,18 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
+import bisect
+import collections
+import concurrent.futures
+import hashlib
 import http.client
 import json
 import logging
 import os
 import sys
+import tempfile
+import time
 import urllib.parse
 
 LOG_LEVEL = logging.INFO
@@ -16,52 +23,348 @@ LOG = logging.getLogger(__name__)
 
 DESCRIPTION ="""Searches CVEs via the https://cve.circl.lu/api."""
 
-def get_json(url):
+CACHE_DIR = "/tmp/cvesearch-cache"
+CACHE_TTL = 86400
+
+
+class ResponseCache:
+    """An on-disk cache of response bodies keyed by URL.
+
+    Entries younger than `ttl` seconds are served without a request. Older
+    entries are revalidated with If-None-Match/If-Modified-Since. In `offline`
+    mode only the cache is consulted, regardless of entry age.
+    """
+
+    def __init__(self, path, ttl=CACHE_TTL, offline=False):
+        self.path = path
+        self.ttl = ttl
+        self.offline = offline
+        os.makedirs(path, exist_ok=True)
+
+    def _path(self, url, suffix):
+        return os.path.join(self.path, hashlib.sha256(url.encode("utf-8")).hexdigest() + suffix)
+
+    def _write(self, path, data):
+        # write to a temporary file first: concurrent readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, url):
+        """Returns the (body, metadata) of a cached response or (None, None)."""
+        try:
+            with open(self._path(url, ".meta"), "rb") as f:
+                meta = json.load(f)
+            with open(self._path(url, ".body"), "rb") as f:
+                return f.read(), meta
+        except FileNotFoundError:
+            return None, None
+
+    def is_fresh(self, meta):
+        return time.time() - meta["fetched"] < self.ttl
+
+    def validators(self, meta):
+        """Returns the conditional request headers for a cached response."""
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def put(self, url, body, headers):
+        meta = {"url": url, "fetched": time.time(),
+                "etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified")}
+        self._write(self._path(url, ".body"), body)
+        self._write(self._path(url, ".meta"), json.dumps(meta).encode("utf-8"))
+
+    def touch(self, url, meta):
+        """Marks a revalidated entry as fresh."""
+        meta["fetched"] = time.time()
+        self._write(self._path(url, ".meta"), json.dumps(meta).encode("utf-8"))
+
+
+def get_json(url, conn=None, cache=None):
+    """GETs a JSON document. If a connection is given it is left open for
+    reuse, otherwise a new connection is created and closed afterwards.
+    With a cache, fresh cached responses are served without a request."""
     LOG.debug("getting: %s", url)
-    url = urllib.parse.urlparse(url)
+    headers = {}
+    if cache:
+        cached, meta = cache.get(url)
+        if cached is not None and (cache.offline or cache.is_fresh(meta)):
+            LOG.debug("cache hit: %s", url)
+            return json.loads(cached)
+        if cache.offline:
+            raise RuntimeError("not in cache (offline): {}".format(url))
+        if cached is not None:
+            headers = cache.validators(meta)
 
-    conn = http.client.HTTPSConnection(url.netloc)
+    u = urllib.parse.urlparse(url)
+    keep_alive = conn is not None
+    if not keep_alive:
+        conn = http.client.HTTPSConnection(u.netloc)
     try:
-        conn.request("GET", url.path)
+        conn.request("GET", u.path, headers=headers)
         r = conn.getresponse()
+        body = r.read()
         LOG.debug("%d: %s", r.status, r.reason)
+        if r.status == 304 and headers:
+            LOG.debug("cache revalidated: %s", url)
+            cache.touch(url, meta)
+            return json.loads(cached)
         if r.status != 200:
             raise RuntimeError("GET failed: {}: {}".format(r.status, r.reason))
-        return json.loads(r.read())
+        data = json.loads(body)
+        if cache:
+            cache.put(url, body, r.headers)
+        return data
     finally:
-        conn.close()
+        if not keep_alive:
+            conn.close()
+
+
+class ConnectionPool:
+    """A bounded pool of keep-alive HTTPS connections. At most `size` requests
+    are in flight at any time; the blocking requests run in worker threads."""
+
+    def __init__(self, size, cache=None):
+        self.size = size
+        self.cache = cache
+        self.conns = asyncio.Queue()
+        for _ in range(size):
+            # connections are created on first use
+            self.conns.put_nowait((None, None))
+
+    async def get_json(self, url):
+        netloc = urllib.parse.urlparse(url).netloc
+        conn_netloc, conn = await self.conns.get()
+        try:
+            if conn is None or conn_netloc != netloc:
+                if conn:
+                    conn.close()
+                conn = http.client.HTTPSConnection(netloc)
+            try:
+                return await asyncio.to_thread(get_json, url, conn, self.cache)
+            except (http.client.RemoteDisconnected, ConnectionError):
+                # the server may have closed an idle connection
+                conn.close()
+                conn = http.client.HTTPSConnection(netloc)
+                return await asyncio.to_thread(get_json, url, conn, self.cache)
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            conn = None
+            raise
+        finally:
+            self.conns.put_nowait((netloc, conn))
+
+
+def read_items(path):
+    """Reads one item per line from a file (`-` for stdin), skipping blank
+    lines and # comments."""
+    f = sys.stdin if path == "-" else open(path)
+    try:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+async def batch_lookup(items, to_url, concurrency, cache=None, out=sys.stdout):
+    """Looks up all items concurrently and writes one JSON object per item
+    and line to `out` as results arrive: {"query": item, "result": ...} or
+    {"query": item, "error": "..."}."""
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=concurrency))
+    pool = ConnectionPool(concurrency, cache)
+
+    async def lookup(item):
+        try:
+            record = {"query": item, "result": await pool.get_json(to_url(item))}
+        except Exception as e:
+            record = {"query": item, "error": str(e)}
+        out.write(json.dumps(record) + "\n")
+        out.flush()
+
+    await asyncio.gather(*(lookup(item) for item in items))
+
+
+def trigrams(name):
+    padded = "  {} ".format(name)
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def normalize_name(query):
+    """Vendor and product keys are lower case with underscores for spaces."""
+    return query.strip().lower().replace(" ", "_")
+
+
+class NameIndex:
+    """A sorted array of names for prefix lookups plus a trigram index (name
+    positions per trigram) for fuzzy lookups."""
+
+    def __init__(self, names, state=None):
+        if state:
+            # a previously built index (see `state`)
+            self.names, self.trigram_counts, self.postings = state
+            return
+        self.names = sorted(set(names))
+        self.trigram_counts = []
+        postings = collections.defaultdict(list)
+        for i, name in enumerate(self.names):
+            grams = trigrams(name)
+            self.trigram_counts.append(len(grams))
+            for gram in grams:
+                postings[gram].append(i)
+        self.postings = dict(postings)
+
+    def state(self):
+        """Returns the built index as plain (JSON serializable) data."""
+        return self.names, self.trigram_counts, self.postings
+
+    def prefixed(self, prefix):
+        """Returns all names starting with prefix."""
+        start = bisect.bisect_left(self.names, prefix)
+        end = bisect.bisect_left(self.names, prefix + "\uffff")
+        return self.names[start:end]
+
+    def similar(self, query):
+        """Returns (similarity, name) pairs for names sharing trigrams with the
+        query, most similar first. Similarity is the Jaccard index of the
+        trigram sets."""
+        grams = trigrams(query)
+        shared = collections.Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, []))
+        scored = [(n / (len(grams) + self.trigram_counts[i] - n), self.names[i]) for i, n in shared.items()]
+        return sorted(scored, key=lambda s: (-s[0], s[1]))
+
+    def find(self, query, limit=10):
+        """Returns up to `limit` names matching the query: an exact match first,
+        then prefix matches (shortest first), then fuzzy matches."""
+        query = normalize_name(query)
+        matches = sorted(self.prefixed(query), key=lambda n: (len(n), n))[:limit]
+        if len(matches) < limit:
+            found = set(matches)
+            matches += [n for _, n in self.similar(query) if n not in found][:limit - len(matches)]
+        return matches
+
+
+def name_index(args, name, url, extract):
+    """Returns the NameIndex over the names that `extract` finds in the JSON
+    at the given URL. The built index is persisted in the cache directory and
+    reused as long as it is younger than the cache TTL (or at any age when
+    offline). After that it is only rebuilt if the names have changed."""
+    path = os.path.join(args.cache_dir, "index", name + ".json")
+    data = None
+    if args.cache:
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if "index" not in data:
+                # a names-only index of an earlier version: rebuild it
+                data = None
+            elif args.offline or time.time() - data["built"] < args.cache_ttl:
+                return NameIndex(None, state=data["index"])
+        except FileNotFoundError:
+            if args.offline:
+                raise RuntimeError("no {} index in cache (offline)".format(name))
+    names = sorted(set(extract(get_json(url, cache=args.cache)) or []))
+    if data and data["index"][0] == names:
+        index = NameIndex(None, state=data["index"])
+    else:
+        index = NameIndex(names)
+    if args.cache:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first: concurrent readers never see partial indices
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as f:
+            json.dump({"built": time.time(), "index": index.state()}, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    return index
+
+
+def vendor_index(args):
+    return name_index(args, "vendors", "https://cve.circl.lu/api/browse/", lambda data: data["vendor"])
+
+
+def product_index(args, vendor):
+    return name_index(args, "products-" + urllib.parse.quote(vendor, safe=""),
+                      "https://cve.circl.lu/api/browse/{}".format(vendor), lambda data: data["product"])
+
+
+def resolve(index, query, kind):
+    matches = index.find(query, limit=1)
+    if not matches:
+        raise ValueError("no {} matches '{}'".format(kind, query))
+    if matches[0] != query:
+        LOG.info("resolved %s '%s' to '%s'", kind, query, matches[0])
+    return matches[0]
 
 
 def vendor_list(args):
-    data = get_json("https://cve.circl.lu/api/browse/")
+    data = get_json("https://cve.circl.lu/api/browse/", cache=args.cache)
     print(json.dumps(data, indent=4))
 
 
 def vendor_products(args):
-    data = get_json("https://cve.circl.lu/api/browse/{}".format(args.vendor))
+    data = get_json("https://cve.circl.lu/api/browse/{}".format(args.vendor), cache=args.cache)
     print(json.dumps(data, indent=4))
 
 
 def cve_byvp(args):
     """Search CVEs by vendor and product."""
+    vendor, product = args.vendor, args.product
+    if args.resolve:
+        vendor = resolve(vendor_index(args), vendor, "vendor")
+        product = resolve(product_index(args, vendor), product, "product")
     data = get_json("https://cve.circl.lu/api/search/{v}/{p}".format(
-        v=args.vendor, p=args.product))
+        v=vendor, p=product), cache=args.cache)
     print(json.dumps(data, indent=4))
 
 
+def find(args):
+    """Find vendors (or products of a vendor) by prefix or approximate name."""
+    if args.product is None:
+        matches = vendor_index(args).find(args.vendor, args.limit)
+    else:
+        vendor = resolve(vendor_index(args), args.vendor, "vendor")
+        matches = [{"vendor": vendor, "product": p} for p in product_index(args, vendor).find(args.product, args.limit)]
+    print(json.dumps(matches, indent=4))
+
+
 def cve_byid(args):
     """Search CVEs by ID (CVE-2016-3333)."""
-    data = get_json("https://cve.circl.lu/api/cve/{id}".format(id=args.id))
+    data = get_json("https://cve.circl.lu/api/cve/{id}".format(id=args.id), cache=args.cache)
     print(json.dumps(data, indent=4))
 
 def cve_bycpe(args):
     """Search CVEs by CPE (cpe:2.3:a:vmware:springsource_spring_framework:*:*:*:*:*:*:*:*)."""
-    data = get_json("https://cve.circl.lu/api/cvefor/{cpe}".format(cpe=args.cpe))
+    data = get_json("https://cve.circl.lu/api/cvefor/{cpe}".format(cpe=args.cpe), cache=args.cache)
     print(json.dumps(data, indent=4))
 
 
+def batch_byid(args):
+    """Look up many CVE IDs concurrently."""
+    ids = read_items(args.input)
+    asyncio.run(batch_lookup(ids, "https://cve.circl.lu/api/cve/{}".format, args.concurrency, args.cache))
+
+
+def batch_bycpe(args):
+    """Look up CVEs for many CPEs concurrently."""
+    cpes = read_items(args.input)
+    asyncio.run(batch_lookup(cpes, "https://cve.circl.lu/api/cvefor/{}".format, args.concurrency, args.cache))
+
+
 def main():
     parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="Directory in which API responses are cached.")
+    parser.add_argument("--cache-ttl", type=int, default=CACHE_TTL,
+                        help="Seconds during which a cached response is used without revalidating it with the server.")
+    parser.add_argument("--no-cache", action="store_true", default=False, help="Neither use nor populate the response cache.")
+    parser.add_argument("--offline", action="store_true", default=False,
+                        help="Answer purely from the response cache (regardless of age), never contact the server.")
     subparsers = parser.add_subparsers()
 
     vendor_list_parser = subparsers.add_parser("vendor-list", help="list all vendors")
@@ -74,8 +377,17 @@ def main():
     cve_byvp_parser = subparsers.add_parser("cve-byvp", help="list CVEs for a vendor/product pair")
     cve_byvp_parser.add_argument("vendor", help="The vendor to search for.")
     cve_byvp_parser.add_argument("product", help="The product to search for.")
+    cve_byvp_parser.add_argument("--resolve", action="store_true", default=False,
+                                 help="Replace vendor and product with their best match in the local name index (see `find`).")
     cve_byvp_parser.set_defaults(func=cve_byvp)
 
+    find_parser = subparsers.add_parser("find", help="find vendor/product names by prefix or approximate spelling")
+    find_parser.add_argument("vendor", help="(Partial) vendor name.")
+    find_parser.add_argument("product", nargs="?", default=None,
+                             help="(Partial) product name. If given, products of the best matching vendor are searched.")
+    find_parser.add_argument("--limit", type=int, default=10, help="Max number of matches.")
+    find_parser.set_defaults(func=find)
+
     cve_byid_parser = subparsers.add_parser("cve-byid", help="show a particular CVE.")
     cve_byid_parser.add_argument("id", metavar="cve-id", help="The CVE id (such as CVE-2016-3333).")
     cve_byid_parser.set_defaults(func=cve_byid)
@@ -84,10 +396,23 @@ def main():
     cve_bycpe_parser.add_argument("cpe", metavar="cpe", help="The CPE URI (such as cpe:2.3:a:vmware:springsource_spring_framework:*:*:*:*:*:*:*:*).")
     cve_bycpe_parser.set_defaults(func=cve_bycpe)
 
+    batch_byid_parser = subparsers.add_parser("batch-byid", help="show many CVEs (as NDJSON).")
+    batch_byid_parser.add_argument("input", nargs="?", default="-", help="File with one CVE id per line (default: stdin).")
+    batch_byid_parser.add_argument("--concurrency", type=int, default=8, help="Max number of concurrent requests.")
+    batch_byid_parser.set_defaults(func=batch_byid)
+
+    batch_bycpe_parser = subparsers.add_parser("batch-bycpe", help="list CVEs for many CPEs (as NDJSON).")
+    batch_bycpe_parser.add_argument("input", nargs="?", default="-", help="File with one CPE URI per line (default: stdin).")
+    batch_bycpe_parser.add_argument("--concurrency", type=int, default=8, help="Max number of concurrent requests.")
+    batch_bycpe_parser.set_defaults(func=batch_bycpe)
+
     args = parser.parse_args()
     if not "func" in args:
         parser.print_help()
         sys.exit(0)
+    if args.no_cache and args.offline:
+        parser.error("--offline requires the cache")
+    args.cache = None if args.no_cache else ResponseCache(args.cache_dir, args.cache_ttl, args.offline)
     args.func(args)
 
 
@@ -1,12 +1,20 @@
 #! /usr/bin/env python3
 
 import argparse
-from datetime import datetime, timezone
+import concurrent.futures
+from datetime import datetime, timedelta, timezone
+import gzip
 import http.client
+import itertools
 import logging
 import json
 import os
+import queue
+import random
+import shutil
+import sqlite3
 import sys
+import threading
 import time
 import urllib.parse
 
@@ -15,104 +23,678 @@ LOG_LEVEL = 'INFO'
 if 'LOG_LEVEL' in os.environ:
     LOG_LEVEL = getattr(logging, os.environ['LOG_LEVEL'].upper())
 LOG = logging.getLogger(__name__)
-logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s [%(levelname)s] %(message)s', stream=sys.stdout)
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s [%(levelname)s] %(message)s', stream=sys.stderr)
 
 CVE_API_URL = "https://services.nvd.nist.gov/rest/json/cves/2.0"
 PAGE_SIZE = 2000
-# Recommended in https://nvd.nist.gov/developers/api-workflows
-PAGE_DELAY_SEC = 6
-
-class Response:
-    def __init__(self, http_response):
-        """
-        http.client.HTTPResponse
-        """
-        self.headers = http_response.headers
-        self.status = http_response.status
-        self.reason = http_response.reason
-        self.body = http_response.read().decode("utf-8")
-        http_response.close()
-
-
-def get(url):
-    u = urllib.parse.urlparse(url)
-    conn = http.client.HTTPSConnection(u.netloc)
-    try:
-        LOG.debug("connecting to %s", u.geturl())
-        conn.request("GET", u.geturl())
-        resp = conn.getresponse()
+# Rolling-window request quotas, see https://nvd.nist.gov/developers/start-here
+RATE_LIMIT_WINDOW_SEC = 30
+RATE_LIMIT_UNKEYED = 5
+RATE_LIMIT_KEYED = 50
+# HTTP statuses with which NVD signals throttling or temporary unavailability.
+RETRY_STATUSES = [403, 429, 502, 503, 504]
+MAX_RETRIES = 8
+BACKOFF_BASE_SEC = 6
+BACKOFF_MAX_SEC = 300
+# lastModStartDate/lastModEndDate ranges may not exceed this many days.
+MAX_WINDOW_DAYS = 120
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+MIRROR_DB = '/tmp/nvd-mirror.sqlite'
+
+class HTTPError(RuntimeError):
+    def __init__(self, status, reason, retry_after=None):
+        super().__init__(f'request failed: {status} ({reason})')
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Client:
+    """An HTTP(S) client that keeps one connection per host alive across
+    requests, asks for gzip-compressed responses and decodes JSON bodies
+    straight from the (decompressed) byte stream."""
+
+    def __init__(self):
+        self.conns = {}
+
+    def _connection(self, u):
+        key = (u.scheme, u.netloc)
+        if key not in self.conns:
+            LOG.debug("connecting to %s://%s", u.scheme, u.netloc)
+            if u.scheme == 'http':
+                self.conns[key] = http.client.HTTPConnection(u.netloc)
+            else:
+                self.conns[key] = http.client.HTTPSConnection(u.netloc)
+        return self.conns[key]
+
+    def _reset(self, u):
+        conn = self.conns.pop((u.scheme, u.netloc), None)
+        if conn:
+            conn.close()
+
+    def get(self, url, headers=None):
+        """Sends a GET request and returns the http.client.HTTPResponse. The
+        caller must read the response to the end before the next request."""
+        u = urllib.parse.urlparse(url)
+        target = u.path + (f'?{u.query}' if u.query else '')
+        request_headers = {'Accept-Encoding': 'gzip'}
+        request_headers.update(headers or {})
+        for attempt in range(2):
+            conn = self._connection(u)
+            try:
+                conn.request("GET", target, headers=request_headers)
+                resp = conn.getresponse()
+                break
+            except Exception as e:
+                # never leave a connection in an unknown state behind
+                self._reset(u)
+                # the server may have closed an idle keep-alive connection
+                if attempt > 0 or not isinstance(e, (http.client.RemoteDisconnected, ConnectionError)):
+                    raise
+                LOG.debug("connection to %s lost (%s), reconnecting ...", u.netloc, e)
         if resp.status in [301, 302]:
-            LOG.debug("%s redirected: %d (%s): %s", u.netloc, resp.status, resp.reason, resp.headers["Location"])
-            return get(resp.headers["Location"])
-        return Response(resp)
-    finally:
-        conn.close()
+            location = resp.headers["Location"]
+            resp.read()
+            LOG.debug("%s redirected: %d (%s): %s", u.netloc, resp.status, resp.reason, location)
+            return self.get(urllib.parse.urljoin(url, location), headers)
+        resp.url = url
+        return resp
+
+    def get_json(self, url, headers=None):
+        resp = self.get(url, headers)
+        try:
+            if resp.status != 200:
+                retry_after = resp.getheader('Retry-After')
+                resp.read()
+                raise HTTPError(resp.status, resp.reason,
+                                int(retry_after) if retry_after and retry_after.isdigit() else None)
+            body = resp
+            if resp.getheader('Content-Encoding') == 'gzip':
+                body = gzip.GzipFile(fileobj=resp)
+            result = json.load(body)
+            # drain whatever is left so that the connection can be reused
+            resp.read()
+            return result
+        except HTTPError:
+            raise
+        except Exception:
+            # a body broken off mid-read (IncompleteRead, reset, truncated
+            # gzip, ...) leaves the connection unusable for the next request
+            self._reset(urllib.parse.urlparse(resp.url))
+            raise
+
+    def close(self):
+        for conn in self.conns.values():
+            conn.close()
+        self.conns = {}
+
+
+CLIENTS = threading.local()
+
+def client():
+    """Returns the Client of the calling thread (connections cannot be shared
+    between threads)."""
+    if not hasattr(CLIENTS, 'client'):
+        CLIENTS.client = Client()
+    return CLIENTS.client
+
+def get_json(url, headers=None):
+    return client().get_json(url, headers)
+
+
+class TokenBucket:
+    """A thread-safe token bucket. `acquire` blocks until a token is available.
+
+    With capacity c and refill rate r, at most c + r*w tokens can be taken in
+    any window of w seconds. The bucket can be slowed down when the server
+    signals throttling and recovers gradually towards its initial rate.
+    """
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.max_rate = rate
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def slow_down(self):
+        with self.lock:
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
 
-def get_json(url):
-    resp = get(url)
-    if resp.status != 200:
-        raise RuntimeError(f'request failed: {resp.status} ({resp.reason})')
-    return json.loads(resp.body)
+    def speed_up(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 8)
 
 
-def get_cve_page(url, offset, page_size):
+class Scheduler:
+    """Paces NVD API requests to stay within the (keyed or unkeyed) rate limit
+    quota. Throttled requests are retried with exponential backoff and jitter,
+    honoring any Retry-After header."""
+
+    def __init__(self, api_key=None, max_retries=MAX_RETRIES):
+        quota = RATE_LIMIT_KEYED if api_key else RATE_LIMIT_UNKEYED
+        # keep burst + refill within the quota of any rolling window
+        capacity = max(1, quota // 10)
+        self.bucket = TokenBucket(capacity, (quota - capacity) / RATE_LIMIT_WINDOW_SEC)
+        self.headers = {'apiKey': api_key} if api_key else {}
+        self.max_retries = max_retries
+
+    def get_json(self, url):
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                result = get_json(url, self.headers)
+                self.bucket.speed_up()
+                return result
+            except (HTTPError, OSError, http.client.HTTPException) as e:
+                if isinstance(e, HTTPError) and e.status not in RETRY_STATUSES:
+                    raise
+                if attempt >= self.max_retries:
+                    raise
+                self.bucket.slow_down()
+                delay = getattr(e, 'retry_after', None)
+                if delay is None:
+                    delay = min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * 2**attempt) * random.uniform(0.5, 1.5)
+                attempt += 1
+                LOG.warning('%s, retrying in %.1fs (attempt %d/%d) ...', e, delay, attempt, self.max_retries)
+                time.sleep(delay)
+
+
+class Checkpoint:
+    """Stores the result pages of a query in a directory as they are fetched,
+    so that an interrupted harvest can resume where it stopped. The directory
+    holds a `state.json` identifying the query and one `page-<offset>.json`
+    file per fetched page."""
+
+    def __init__(self, path, url, page_size):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        state = {'url': url, 'page_size': page_size}
+        state_path = os.path.join(path, 'state.json')
+        if os.path.isfile(state_path):
+            with open(state_path) as f:
+                if json.load(f) == state:
+                    LOG.info('resuming from checkpoint %s (%d pages fetched)', path, len(self.offsets()))
+                    return
+            LOG.warning('discarding checkpoint %s of a different query', path)
+            self.remove()
+            os.makedirs(path)
+        with open(state_path, 'w') as f:
+            json.dump(state, f)
+
+    def offsets(self):
+        return sorted(int(name[5:-5]) for name in os.listdir(self.path)
+                      if name.startswith('page-') and name.endswith('.json'))
+
+    def _page_path(self, offset):
+        return os.path.join(self.path, f'page-{offset:09d}.json')
+
+    def load(self, offset):
+        """Returns the stored page at the given offset or None."""
+        try:
+            with open(self._page_path(offset)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, offset, page):
+        tmp_path = self._page_path(offset) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(page, f)
+        os.rename(tmp_path, self._page_path(offset))
+
+    def remove(self):
+        shutil.rmtree(self.path)
+
+
+def get_cve_page(url, offset, page_size, scheduler):
     """Retrieves a single result page for the query in the given URL."""
-    paged_url=f'{url}&startIndex={offset}&resultsPerPage={page_size}'
-    page = get_json(paged_url)
-    LOG.debug('got page: %s', json.dumps(page,indent=2))
-    has_more = (offset + page_size - 1) < page['totalResults']
-    return page['vulnerabilities'], has_more
-
-
-def all_cves(url, page_size=PAGE_SIZE):
-    """Loads all vulnerability pages that match the query in the given URL."""
-    cves = []
-    offset = 0
-    page_num = 0
-    while True:
-        page_num += 1
-        LOG.debug("getting page %d ...", page_num)
-        vulnerabilities, has_more  = get_cve_page(url, offset, page_size)
-        cves += vulnerabilities
-        if not has_more:
-            break
-        offset += page_size
-        time.sleep(PAGE_DELAY_SEC)
-
-    return cves
+    sep = '&' if '?' in url else '?'
+    paged_url=f'{url}{sep}startIndex={offset}&resultsPerPage={page_size}'
+    LOG.debug("getting page at offset %d ...", offset)
+    page = scheduler.get_json(paged_url)
+    if LOG.isEnabledFor(logging.DEBUG):
+        LOG.debug('got page: %s', json.dumps(page,indent=2))
+    return page
+
+
+def cve_pages(url, page_size=PAGE_SIZE, scheduler=None, workers=1, checkpoint_dir=None):
+    """Yields the vulnerabilities of each result page that matches the query in
+    the given URL, one page at a time and in order.
+
+    Once the first page has revealed the total number of results, up to
+    `workers` pages are fetched concurrently (all paced by the same
+    scheduler). With a `checkpoint_dir`, pages are saved as they arrive and
+    already saved pages are read back instead of being fetched again. The
+    checkpoint is removed once all pages have been yielded.
+    """
+    scheduler = scheduler or Scheduler()
+    checkpoint = Checkpoint(checkpoint_dir, url, page_size) if checkpoint_dir else None
+
+    def fetch(offset):
+        page = checkpoint.load(offset) if checkpoint else None
+        if page is None:
+            page = get_cve_page(url, offset, page_size, scheduler)
+            if checkpoint:
+                checkpoint.save(offset, page)
+        return page
+
+    first = fetch(0)
+    yield first['vulnerabilities']
+    offsets = iter(range(page_size, first['totalResults'], page_size))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        # keep a bounded number of pages in flight to keep memory flat
+        pending = [executor.submit(fetch, offset) for offset in itertools.islice(offsets, 2 * workers)]
+        while pending:
+            page = pending.pop(0).result()
+            next_offset = next(offsets, None)
+            if next_offset is not None:
+                pending.append(executor.submit(fetch, next_offset))
+            yield page['vulnerabilities']
+    if checkpoint:
+        checkpoint.remove()
+
+
+def harvest(args, url):
+    """Returns a generator of result pages for a query URL, configured from
+    the command-line arguments."""
+    return cve_pages(url, page_size=args.page_size, scheduler=Scheduler(args.api_key),
+                     workers=args.workers, checkpoint_dir=args.checkpoint)
+
+
+def sharded_pages(page_generators, workers):
+    """Consumes several page generators concurrently, `workers` at a time, and
+    yields their pages in arrival order. Vulnerabilities that were already
+    yielded (adjacent date windows share their boundary) are dropped.
+
+    The generators are consumed by daemon threads that stop as soon as this
+    generator is closed, so a consumer that gives up early (for example on a
+    broken pipe) never keeps the process alive."""
+    pages = queue.Queue(maxsize=2 * workers)
+    pending = queue.SimpleQueue()
+    for generator in page_generators:
+        pending.put(generator)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def drain(generator):
+        try:
+            for page in generator:
+                if not put(page):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+
+    def work():
+        while not stop.is_set():
+            try:
+                generator = pending.get_nowait()
+            except queue.Empty:
+                return
+            drain(generator)
+
+    for _ in range(min(workers, len(page_generators))):
+        threading.Thread(target=work, daemon=True).start()
+    seen = set()
+    remaining = len(page_generators)
+    try:
+        while remaining:
+            item = pages.get()
+            if item is done:
+                remaining -= 1
+                continue
+            if isinstance(item, Exception):
+                raise item
+            fresh = [vuln for vuln in item if vuln['cve']['id'] not in seen]
+            seen.update(vuln['cve']['id'] for vuln in fresh)
+            yield fresh
+    finally:
+        stop.set()
+
+
+def checkpoint_until(args, since, until):
+    """Returns the end time for an update query from `since` that would
+    otherwise end at `until` (now). With a checkpoint, the end time that the
+    query was started with is kept in it, so that re-running an interrupted
+    query resumes it instead of starting a different one."""
+    if not args.checkpoint:
+        return until
+    path = os.path.join(args.checkpoint, 'until.json')
+    if os.path.isfile(path):
+        with open(path) as f:
+            state = json.load(f)
+        if state['since'] == since.isoformat():
+            LOG.info('resuming updates until %s from checkpoint %s', state['until'], args.checkpoint)
+            return datetime.fromisoformat(state['until'])
+    os.makedirs(args.checkpoint, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'since': since.isoformat(), 'until': until.isoformat()}, f)
+    return until
+
+
+def update_pages(args, since, until, extra_query=''):
+    """Returns a generator of result pages for CVEs modified between two (UTC)
+    datetimes. Ranges longer than the NVD API accepts are split into windows
+    that are fetched concurrently, sharing one rate limit budget.
+    `extra_query` is appended to the query string of every window."""
+    windows = update_windows(since, until)
+    if len(windows) <= 1:
+        return harvest(args, updates_url(args.cve_api_url, since, until) + extra_query)
+    LOG.debug('splitting %s - %s into %d windows', since.isoformat(), until.isoformat(), len(windows))
+    scheduler = Scheduler(args.api_key)
+    generators = []
+    for i, (start, end) in enumerate(windows):
+        checkpoint_dir = os.path.join(args.checkpoint, f'window-{i:04d}') if args.checkpoint else None
+        generators.append(cve_pages(updates_url(args.cve_api_url, start, end) + extra_query, page_size=args.page_size,
+                                    scheduler=scheduler, checkpoint_dir=checkpoint_dir))
+
+    def pages():
+        yield from sharded_pages(generators, args.workers)
+        # all windows are done: drop what is left of the checkpoint
+        if args.checkpoint and os.path.isdir(args.checkpoint):
+            shutil.rmtree(args.checkpoint)
+    return pages()
+
+
+def updates_url(cve_api_url, since, until):
+    """Returns a query URL for CVEs modified between two (UTC) datetimes."""
+    encoded_since = urllib.parse.quote(since.strftime(TIME_FORMAT), safe='')
+    encoded_until = urllib.parse.quote(until.strftime(TIME_FORMAT), safe='')
+    return f'{cve_api_url}?lastModStartDate={encoded_since}&lastModEndDate={encoded_until}'
+
+
+def update_windows(since, until, max_days=MAX_WINDOW_DAYS):
+    """Splits the time range [since, until] into consecutive (start, end)
+    windows that are small enough for the NVD API to accept."""
+    windows = []
+    start = since
+    while start < until:
+        end = min(start + timedelta(days=max_days), until)
+        windows.append((start, end))
+        start = end
+    return windows
+
+
+MIRROR_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cves (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT UNIQUE NOT NULL,
+    last_modified TEXT,
+    data TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS descriptions USING fts5(description);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+class Mirror:
+    """A local SQLite copy of the NVD CVE database. CVE descriptions are
+    full-text indexed (FTS5) to serve keyword searches. The rowid of a CVE in
+    the `cves` table is also its rowid in the `descriptions` index."""
+
+    def __init__(self, path, create=False):
+        if not create and not os.path.isfile(path):
+            raise ValueError(f'no local mirror at {path} (run the `mirror` subcommand first)')
+        path_dir = os.path.dirname(path)
+        if path_dir:
+            os.makedirs(path_dir, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(MIRROR_SCHEMA)
+
+    def last_sync(self):
+        """Returns the (UTC) time of the last completed sync or None if the
+        mirror has not been seeded yet."""
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'last_sync'").fetchone()
+        if row is None:
+            return None
+        return datetime.fromisoformat(row[0])
+
+    def set_last_sync(self, ts):
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_sync', ?)", (ts.isoformat(),))
+
+    def store(self, vulnerabilities):
+        """Inserts or replaces a page of vulnerabilities in a single transaction."""
+        with self.db:
+            for vuln in vulnerabilities:
+                cve = vuln['cve']
+                description = ' '.join(d['value'] for d in cve.get('descriptions', []))
+                row = self.db.execute('SELECT rowid FROM cves WHERE id = ?', (cve['id'],)).fetchone()
+                if row:
+                    self.db.execute('UPDATE cves SET last_modified = ?, data = ? WHERE rowid = ?',
+                                    (cve.get('lastModified'), json.dumps(vuln), row[0]))
+                    self.db.execute('DELETE FROM descriptions WHERE rowid = ?', (row[0],))
+                    rowid = row[0]
+                else:
+                    cur = self.db.execute('INSERT INTO cves (id, last_modified, data) VALUES (?, ?, ?)',
+                                          (cve['id'], cve.get('lastModified'), json.dumps(vuln)))
+                    rowid = cur.lastrowid
+                self.db.execute('INSERT INTO descriptions (rowid, description) VALUES (?, ?)', (rowid, description))
+
+    def count(self):
+        return self.db.execute('SELECT count(*) FROM cves').fetchone()[0]
+
+    def get(self, cve_id):
+        rows = self.db.execute('SELECT data FROM cves WHERE id = ?', (cve_id.upper(),))
+        return (json.loads(data) for data, in rows)
+
+    def search(self, keywords):
+        """Yields CVEs whose description contains all keywords. Like the
+        keywordSearch of the NVD API, every word is matched as a prefix (as if
+        it ended with a wildcard)."""
+        words = [word for k in keywords for word in k.split()]
+        query = ' '.join('"{}"*'.format(word.replace('"', '""')) for word in words)
+        rows = self.db.execute(
+            'SELECT cves.data FROM descriptions JOIN cves ON cves.rowid = descriptions.rowid '
+            'WHERE descriptions MATCH ? ORDER BY cves.id', (query,))
+        return (json.loads(data) for data, in rows)
 
 def pretty_json(value):
     return json.dumps(value, indent=2)
 
+def cvss_metrics(cve, *versions):
+    for version in versions:
+        yield from cve.get('metrics', {}).get(version, [])
+
+def cvss_severities(cve, *versions):
+    """Returns the base severities of all CVSS metrics of the given versions.
+    For CVSS v2 the severity is stored next to (not inside) `cvssData`."""
+    return {m.get('baseSeverity') or m['cvssData'].get('baseSeverity') for m in cvss_metrics(cve, *versions)}
+
+def cvss_max_score(cve):
+    scores = [m['cvssData']['baseScore'] for m in cvss_metrics(cve, 'cvssMetricV40', 'cvssMetricV31', 'cvssMetricV30', 'cvssMetricV2')]
+    return max(scores, default=None)
+
+def cpe_matches(pattern, cpe):
+    """Compares two CPE 2.3 names component by component, treating `*` in
+    either as a wildcard. Version ranges are not considered."""
+    pattern, cpe = pattern.split(':'), cpe.split(':')
+    return len(pattern) == len(cpe) and all(p == c or '*' in (p, c) for p, c in zip(pattern, cpe))
+
+def cpe_criteria(cve):
+    for config in cve.get('configurations', []):
+        for node in config.get('nodes', []):
+            for match in node.get('cpeMatch', []):
+                yield match['criteria']
+
+def cve_filters(args):
+    """Returns the filters given on the command line as a list of (NVD query
+    parameter, predicate) pairs. The query parameter is None for filters that
+    the NVD API does not support; those can only be applied to the results.
+    A query parameter with value None is a flag without value."""
+    filters = []
+    if args.cvss_v3_severity:
+        filters.append((('cvssV3Severity', args.cvss_v3_severity),
+                        lambda cve: args.cvss_v3_severity in cvss_severities(cve, 'cvssMetricV31', 'cvssMetricV30')))
+    if args.cvss_v2_severity:
+        filters.append((('cvssV2Severity', args.cvss_v2_severity),
+                        lambda cve: args.cvss_v2_severity in cvss_severities(cve, 'cvssMetricV2')))
+    if args.cpe_name:
+        filters.append((('cpeName', args.cpe_name),
+                        lambda cve: any(cpe_matches(args.cpe_name, c) for c in cpe_criteria(cve))))
+    if args.cwe_id:
+        filters.append((('cweId', args.cwe_id),
+                        lambda cve: any(d['value'] == args.cwe_id for w in cve.get('weaknesses', []) for d in w['description'])))
+    if args.has_kev:
+        filters.append((('hasKev', None), lambda cve: 'cisaExploitAdd' in cve))
+    if args.no_rejected:
+        filters.append((('noRejected', None), lambda cve: cve.get('vulnStatus') != 'Rejected'))
+    if args.min_cvss_score is not None:
+        filters.append((None, lambda cve: (cvss_max_score(cve) or 0) >= args.min_cvss_score))
+    return filters
+
+def filter_query(filters):
+    """Returns the query string suffix that pushes the supported filters down
+    to the NVD API."""
+    query = ''
+    for param, _ in filters:
+        if param is None:
+            continue
+        name, value = param
+        query += f'&{name}' if value is None else f'&{name}={urllib.parse.quote(value, safe="")}'
+    return query
+
+def project(vuln, fields):
+    """Returns a flat record with the given dotted paths (such as `id` or
+    `metrics.cvssMetricV31`) of a vulnerability's `cve` object. Absent paths
+    are left out."""
+    record = {}
+    for field in fields:
+        value = vuln['cve']
+        for key in field.split('.'):
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            record[field] = value
+    return record
+
+def refine(pages, predicates, fields):
+    """Applies filter predicates and field projection to result pages as they
+    stream by."""
+    for vulnerabilities in pages:
+        if predicates:
+            vulnerabilities = [v for v in vulnerabilities if all(p(v['cve']) for p in predicates)]
+        if fields:
+            vulnerabilities = [project(v, fields) for v in vulnerabilities]
+        yield vulnerabilities
+
+def query_pages(args, pages, filters, pushed_down):
+    """Wraps result pages with the filters that were not pushed down to the
+    NVD API and with any --fields projection."""
+    predicates = [predicate for param, predicate in filters if not (pushed_down and param)]
+    fields = args.fields.split(',') if args.fields else None
+    return refine(pages, predicates, fields)
+
+def write_cves(pages, output_format, out=sys.stdout):
+    """Writes the vulnerabilities of an iterable of result pages to `out`.
+
+    The `json` format collects all vulnerabilities into a single JSON array
+    before writing. The `ndjson` (one vulnerability per line) and `json-stream`
+    (an incrementally written JSON array) formats write each vulnerability as
+    soon as its page arrives and never hold more than one page in memory.
+    """
+    if output_format == 'json':
+        cves = []
+        for vulnerabilities in pages:
+            cves += vulnerabilities
+        out.write(pretty_json(cves) + '\n')
+        return
+
+    first = True
+    if output_format == 'json-stream':
+        out.write('[')
+    for vulnerabilities in pages:
+        for vuln in vulnerabilities:
+            if output_format == 'ndjson':
+                out.write(json.dumps(vuln) + '\n')
+            else:
+                out.write(('\n' if first else ',\n') + json.dumps(vuln))
+            first = False
+        out.flush()
+    if output_format == 'json-stream':
+        out.write('\n]\n')
+
 def get_cve(args):
     """Implementation of the `get` subcommand."""
     if not args.cve:
         raise ValueError('missing CVE ID')
-    cves = all_cves(f'{args.cve_api_url}?cveId={args.cve}', page_size=args.page_size)
-    print(pretty_json(cves))
+    filters = cve_filters(args)
+    if args.local:
+        pages = [Mirror(args.mirror_db).get(args.cve)]
+    else:
+        pages = harvest(args, f'{args.cve_api_url}?cveId={args.cve}' + filter_query(filters))
+    write_cves(query_pages(args, pages, filters, pushed_down=not args.local), args.output)
 
 def keyword_search(args):
     """Implementation of the `search` subcommand."""
     if not args.keyword:
         raise ValueError('missing keyword(s)')
-    encoded_keywords = urllib.parse.quote(" ".join(args.keyword), safe='')
-    cves = all_cves(f'{args.cve_api_url}?keywordSearch={encoded_keywords}', page_size=args.page_size)
-    print(pretty_json(cves))
+    filters = cve_filters(args)
+    if args.local:
+        pages = [Mirror(args.mirror_db).search(args.keyword)]
+    else:
+        encoded_keywords = urllib.parse.quote(" ".join(args.keyword), safe='')
+        pages = harvest(args, f'{args.cve_api_url}?keywordSearch={encoded_keywords}' + filter_query(filters))
+    write_cves(query_pages(args, pages, filters, pushed_down=not args.local), args.output)
 
 def list_cve_updates(args):
-    """Implementation of the `search` subcommand."""
+    """Implementation of the `list-updates` subcommand."""
     if not args.since:
         raise ValueError('missing since')
-    if not args.until:
-        raise ValueError('missing until')
 
-    since = datetime.strptime(args.since, '%Y-%m-%dT%H:%M:%S.%f').astimezone(tz=timezone.utc)
-    until = datetime.strptime(args.until, '%Y-%m-%dT%H:%M:%S.%f').astimezone(tz=timezone.utc)
-    encoded_since = urllib.parse.quote(since.strftime('%Y-%m-%dT%H:%M:%S.%f'), safe='')
-    encoded_until = urllib.parse.quote(until.strftime('%Y-%m-%dT%H:%M:%S.%f'), safe='')
-    cves = all_cves(f'{args.cve_api_url}?lastModStartDate={encoded_since}&lastModEndDate={encoded_until}', page_size=args.page_size)
-    print(pretty_json(cves))
+    since = datetime.strptime(args.since, TIME_FORMAT).astimezone(tz=timezone.utc)
+    if args.until:
+        until = datetime.strptime(args.until, TIME_FORMAT).astimezone(tz=timezone.utc)
+    else:
+        until = checkpoint_until(args, since, datetime.now(tz=timezone.utc))
+    filters = cve_filters(args)
+    pages = update_pages(args, since, until, extra_query=filter_query(filters))
+    write_cves(query_pages(args, pages, filters, pushed_down=True), args.output)
 
+def sync_mirror(args):
+    """Implementation of the `mirror` subcommand."""
+    mirror = Mirror(args.mirror_db, create=True)
+    sync_start = datetime.now(tz=timezone.utc)
+    last_sync = mirror.last_sync()
+    if last_sync is None:
+        LOG.info('seeding mirror %s (this takes a while) ...', args.mirror_db)
+        for vulnerabilities in harvest(args, args.cve_api_url):
+            mirror.store(vulnerabilities)
+    else:
+        sync_start = checkpoint_until(args, last_sync, sync_start)
+        LOG.info('updating mirror %s with changes since %s ...', args.mirror_db, last_sync.isoformat())
+        for vulnerabilities in update_pages(args, last_sync, sync_start):
+            mirror.store(vulnerabilities)
+    mirror.set_last_sync(sync_start)
+    LOG.info('mirror synced: %d CVEs stored', mirror.count())
 
 
 if __name__ == "__main__":
@@ -123,6 +705,27 @@ See https://nvd.nist.gov/developers/vulnerabilities
     parser.add_argument("--cve-api-url", dest="cve_api_url", default=CVE_API_URL, help="CVE API to use.")
     parser.add_argument("--page-size", type=int, default=PAGE_SIZE, help="Page size to use for pagination.")
     parser.add_argument("--verbose", action='store_true', default=False, help="Print body in error responses.")
+    parser.add_argument("--api-key", default=os.environ.get('NVD_API_KEY'),
+                        help="NVD API key (default: $NVD_API_KEY). Raises the request rate limit from 5 to 50 requests per 30 seconds.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of result pages (or `list-updates` date windows) to fetch concurrently (within the rate limit).")
+    parser.add_argument("--checkpoint", metavar="DIR",
+                        help="Save fetched pages to this directory so that an interrupted query can be resumed by re-running it.")
+    parser.add_argument("--output", choices=['json', 'ndjson', 'json-stream'], default='json',
+                        help="Output format. `ndjson` and `json-stream` write each CVE as soon as its page arrives.")
+    parser.add_argument("--mirror-db", default=MIRROR_DB, help="Path of the local CVE mirror database.")
+    parser.add_argument("--local", action='store_true', default=False,
+                        help="Answer `get` and `search` from the local mirror (see `mirror`) instead of the NVD API.")
+    parser.add_argument("--fields",
+                        help="Comma-separated list of dotted paths into the CVE object to output, such as `id,lastModified,metrics.cvssMetricV31,configurations`. Each CVE is then output as a flat object keyed by these paths.")
+    severities = ['LOW', 'MEDIUM', 'HIGH', 'CRITICAL']
+    parser.add_argument("--cvss-v3-severity", type=str.upper, choices=severities, help="Only CVEs with this CVSS v3 severity.")
+    parser.add_argument("--cvss-v2-severity", type=str.upper, choices=severities[:3], help="Only CVEs with this CVSS v2 severity.")
+    parser.add_argument("--cpe-name", help="Only CVEs that apply to this CPE 2.3 name (when filtering locally, version ranges are not considered).")
+    parser.add_argument("--cwe-id", help="Only CVEs with this weakness. For example, CWE-79.")
+    parser.add_argument("--has-kev", action='store_true', default=False, help="Only CVEs in CISA's Known Exploited Vulnerabilities catalog.")
+    parser.add_argument("--no-rejected", action='store_true', default=False, help="Exclude rejected CVEs.")
+    parser.add_argument("--min-cvss-score", type=float,
+                        help="Only CVEs with a CVSS base score (any version) of at least this. Not supported by the NVD API, so applied to the results.")
 
     subparsers = parser.add_subparsers(help="subcommands")
 
@@ -132,14 +735,17 @@ See https://nvd.nist.gov/developers/vulnerabilities
 
     list_updates_cmd = subparsers.add_parser("list-updates", help="List CVEs updated since a given time.")
     list_updates_cmd.add_argument("since", help="List CVE updates since this point in time (in local time). Format: 2006-01-02T15:04:05.999")
-    list_updates_cmd.add_argument("--until", default=datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f'),
-                                  help="The end time for the update query (in local time). Default: current time. Format: 2006-01-02T15:04:05.999")
+    list_updates_cmd.add_argument("--until",
+                                  help="The end time for the update query (in local time). Default: current time, or with --checkpoint the time at which the interrupted query was started. Format: 2006-01-02T15:04:05.999")
     list_updates_cmd.set_defaults(action=list_cve_updates)
 
     search_cmd = subparsers.add_parser("search", help="Search for CVEs with matching keywords in its description.")
     search_cmd.add_argument("keyword", nargs="+", help="Keyword to search for (option can occur multiple times).")
     search_cmd.set_defaults(action=keyword_search)
 
+    mirror_cmd = subparsers.add_parser("mirror", help="Seed or incrementally update the local CVE mirror.")
+    mirror_cmd.set_defaults(action=sync_mirror)
+
     args = parser.parse_args()
     if not hasattr(args, "action"):
         print("please specify a subcommand (--help for usage)")
@@ -1,12 +1,20 @@
 #! /usr/bin/env python3
 
 import argparse
+import codecs
+import concurrent.futures
 import http.client
 import logging
 import json
+import mmap
+import os
 import re
 import sys
-from urllib.parse import urlparse
+import tempfile
+import threading
+import time
+from urllib.parse import urljoin, urlparse
+import xmlrpc.client
 
 LOG = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -15,6 +23,31 @@ logging.basicConfig(level=logging.INFO)
 PACKAGE_LINK = re.compile(r'<a href="[^"]+">([^<]+)</a>')
 """Pattern that matches a package link in the PyPi simple project API"""
 
+PROJECTS_KEY = re.compile(r'"projects"\s*:\s*\[')
+"""Pattern that matches the start of the project list in a PEP 691 JSON simple index"""
+
+SIMPLE_JSON = "application/vnd.pypi.simple.v1+json"
+"""PEP 691 content type of the JSON simple API"""
+
+CHUNK_SIZE = 64 * 1024
+
+NAME_STORE_DIR = "/tmp/pypi-names"
+
+METADATA_CACHE_DIR = "/tmp/pypi-metadata"
+
+VERSION_PATTERN = re.compile(r"""
+    ^\s*v?
+    (?:(?P<epoch>[0-9]+)!)?
+    (?P<release>[0-9]+(?:\.[0-9]+)*)
+    (?:[-_.]?(?P<pre_l>alpha|a|beta|b|preview|pre|c|rc)[-_.]?(?P<pre_n>[0-9]+)?)?
+    (?:-(?P<post_n1>[0-9]+)|[-_.]?(?P<post_l>post|rev|r)[-_.]?(?P<post_n2>[0-9]+)?)?
+    (?P<dev_l>[-_.]?dev[-_.]?(?P<dev_n>[0-9]+)?)?
+    (?:\+(?P<local>[a-z0-9]+(?:[-_.][a-z0-9]+)*))?
+    \s*$""", re.VERBOSE | re.IGNORECASE)
+"""Pattern that matches a PEP 440 version"""
+
+PRE_RELEASE_RANK = {"a": 0, "alpha": 0, "b": 1, "beta": 1, "c": 2, "rc": 2, "pre": 2, "preview": 2}
+
 class Response:
     def __init__(self, http_response):
         """
@@ -27,25 +60,238 @@ class Response:
         http_response.close()
 
 
-def get(url):
+def get(url, conns=None, headers=None):
+    """GETs a URL. With a `conns` dict (host to connection), connections are
+    taken from and kept in it for reuse instead of being closed."""
     u = urlparse(url)
-    conn = http.client.HTTPSConnection(u.netloc)
+    keep_alive = conns is not None
+    if keep_alive and u.netloc in conns:
+        conn = conns.pop(u.netloc)
+    else:
+        conn = http.client.HTTPSConnection(u.netloc)
     try:
-        conn.request("GET", u.path)
-        resp = conn.getresponse()
+        try:
+            conn.request("GET", u.path, headers=headers or {})
+            resp = conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionError):
+            if not keep_alive:
+                raise
+            # the server may have closed an idle connection
+            conn.close()
+            conn = http.client.HTTPSConnection(u.netloc)
+            conn.request("GET", u.path, headers=headers or {})
+            resp = conn.getresponse()
         if resp.status in [301, 302]:
             LOG.debug("%s redirected: %d (%s): %s", u.netloc, resp.status, resp.reason, resp.headers["Location"])
-            return get(resp.headers["Location"])
-        return Response(resp)
+            resp.read()
+            if keep_alive:
+                conns[u.netloc] = conn
+            return get(urljoin(url, resp.headers["Location"]), conns, headers)
+        response = Response(resp)
+        if keep_alive:
+            conns[u.netloc] = conn
+        return response
+    finally:
+        if not keep_alive or conns.get(u.netloc) is not conn:
+            conn.close()
+
+def open_stream(url, headers=None):
+    """Sends a GET request (following redirects) and returns the connection
+    and its unread http.client.HTTPResponse. The caller closes the
+    connection."""
+    u = urlparse(url)
+    conn = http.client.HTTPSConnection(u.netloc)
+    conn.request("GET", u.path, headers=headers or {})
+    resp = conn.getresponse()
+    if resp.status in [301, 302]:
+        LOG.debug("%s redirected: %d (%s): %s", u.netloc, resp.status, resp.reason, resp.headers["Location"])
+        conn.close()
+        return open_stream(urljoin(url, resp.headers["Location"]), headers)
+    return conn, resp
+
+class ProjectNameScanner:
+    """Incrementally extracts project names from a PEP 691 JSON simple index
+    as text is fed to it. Only the project currently being parsed is held in
+    memory, never the whole document."""
+
+    def __init__(self):
+        self.buf = ""
+        self.in_projects = False
+        self.done = False
+        self.decoder = json.JSONDecoder()
+
+    def feed(self, text):
+        """Returns the names of the projects completed by this text."""
+        self.buf += text
+        names = []
+        pos = 0
+        if not self.in_projects:
+            m = PROJECTS_KEY.search(self.buf)
+            if not m:
+                return names
+            self.in_projects = True
+            pos = m.end()
+        while not self.done:
+            while pos < len(self.buf) and self.buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(self.buf):
+                break
+            if self.buf[pos] == "]":
+                self.done = True
+                break
+            try:
+                project, pos = self.decoder.raw_decode(self.buf, pos)
+            except json.JSONDecodeError:
+                # incomplete project entry: wait for more text
+                break
+            names.append(project["name"])
+        self.buf = self.buf[pos:]
+        return names
+
+def iter_packages_or_die(package_index, meta=None):
+    """Yields the package names of a package index's simple API as the
+    response arrives. The PEP 691 JSON format is requested since it is
+    cheaper to parse, but HTML responses are handled as well. If a `meta`
+    dict is given, the index's last serial (or None) is stored under
+    "serial"."""
+    conn, resp = open_stream(f"https://{package_index}/simple/",
+                             headers={"Accept": f"{SIMPLE_JSON}, text/html;q=0.1"})
+    try:
+        if resp.status != 200:
+            LOG.error("pypi.org query failed: %d (%s)", resp.status, resp.reason)
+            sys.exit(1)
+        if meta is not None:
+            serial = resp.getheader("X-PyPI-Last-Serial")
+            meta["serial"] = int(serial) if serial else None
+        content_type = resp.getheader("Content-Type", "")
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        if content_type.startswith(SIMPLE_JSON):
+            scanner = ProjectNameScanner()
+            while chunk := resp.read(CHUNK_SIZE):
+                yield from scanner.feed(decoder.decode(chunk))
+            if not scanner.done:
+                LOG.error("truncated simple index response")
+                sys.exit(1)
+        else:
+            partial = ""
+            while chunk := resp.read(CHUNK_SIZE):
+                lines = (partial + decoder.decode(chunk)).split("\n")
+                partial = lines.pop()
+                for line in lines:
+                    m = PACKAGE_LINK.match(line.lstrip())
+                    if m:
+                        yield m.group(1)
+            m = PACKAGE_LINK.match(partial.lstrip())
+            if m:
+                yield m.group(1)
     finally:
         conn.close()
 
-def get_package_metadata(package_index, package, version=None):
+def normalize(name):
+    """PEP 503 name normalization."""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+class NameStore:
+    """A local, sorted list of a package index's project names.
+
+    Names are stored one per line, ordered case-insensitively, next to a
+    state file recording the index serial they reflect. Queries memory-map
+    the file and binary search it, so they do not materialize the names as
+    Python strings.
+    """
+
+    def __init__(self, store_dir, package_index):
+        self.path = os.path.join(store_dir, package_index)
+        self.names_path = os.path.join(self.path, "names")
+        self.state_path = os.path.join(self.path, "state.json")
+
+    def serial(self):
+        """Returns the serial of the stored names, or None if unknown."""
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)["serial"]
+        except FileNotFoundError:
+            return None
+
+    def exists(self):
+        return os.path.isfile(self.names_path) and os.path.isfile(self.state_path)
+
+    def write(self, names, serial):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = self.names_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            # same (ASCII case-insensitive byte) order as the binary search
+            for name in sorted(names, key=lambda n: n.encode("utf-8").lower()):
+                f.write(name + "\n")
+        os.replace(tmp_path, self.names_path)
+        with open(self.state_path, "w") as f:
+            json.dump({"serial": serial}, f)
+
+    def read(self):
+        with open(self.names_path, encoding="utf-8") as f:
+            return [line.rstrip("\n") for line in f]
+
+    def _lower_bound(self, mm, key):
+        """Returns the offset of the first line that is not less than key."""
+        lo, hi = 0, len(mm)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = mm.rfind(b"\n", 0, mid) + 1
+            end = mm.find(b"\n", start)
+            if mm[start:end].lower() < key:
+                lo = end + 1
+            else:
+                hi = start
+        return lo
+
+    def write_names(self, out, prefix=""):
+        """Writes the (case-insensitively) prefixed names to a binary stream."""
+        if os.path.getsize(self.names_path) == 0:
+            return
+        with open(self.names_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if not prefix:
+                out.write(mm)
+                return
+            key = prefix.lower().encode("utf-8")
+            pos = self._lower_bound(mm, key)
+            while pos < len(mm):
+                end = mm.find(b"\n", pos)
+                if not mm[pos:end].lower().startswith(key):
+                    break
+                out.write(mm[pos:end + 1])
+                pos = end + 1
+
+def sync_name_store(store, package_index):
+    """Brings a NameStore up to date: with the index's changelog when the
+    store's serial is known, otherwise (or if the index has no changelog API)
+    with a full download of the simple index."""
+    serial = store.serial() if store.exists() else None
+    if serial is not None:
+        try:
+            events = xmlrpc.client.ServerProxy(f"https://{package_index}/pypi").changelog_since_serial(serial)
+        except (xmlrpc.client.Error, OSError) as e:
+            LOG.warning("changelog unavailable (%s), downloading full index", e)
+        else:
+            LOG.debug("applying %d changelog events since serial %d", len(events), serial)
+            names = {normalize(name): name for name in store.read()}
+            for name, _version, _timestamp, action, event_serial in events:
+                if action == "remove project":
+                    names.pop(normalize(name), None)
+                else:
+                    names.setdefault(normalize(name), name)
+                serial = max(serial, event_serial)
+            store.write(names.values(), serial)
+            return
+    meta = {}
+    names = list(iter_packages_or_die(package_index, meta))
+    store.write(names, meta["serial"])
+
+def get_package_metadata(package_index, package, version=None, conns=None):
     pkg_path = package
     if version:
         pkg_path += f"/{version}"
 
-    return get(f"https://{package_index}/pypi/{pkg_path}/json")
+    return get(f"https://{package_index}/pypi/{pkg_path}/json", conns)
 
 
 
@@ -58,56 +304,451 @@ def get_package_metadata_or_die(package_index, package, version=None):
         sys.exit(1)
     return json.loads(resp.body)
 
-def list_packages_or_die(package_index):
-    resp = get(f"https://{package_index}/simple")
-    if resp.status != 200:
-        LOG.error("pypi.org query failed: %d (%s)", resp.status, resp.reason)
-        sys.exit(1)
-    pkgs = []
-    for line in resp.body.split('\n'):
-        m = PACKAGE_LINK.match(line.lstrip())
+REQUIREMENT = re.compile(r'^([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:\[[^\]]*\])?\s*(?:===?\s*([^\s,;#*]+)\s*|(?:~=|===?|!=|<=|>=|<|>)[^;#]*)?(?:[;#].*)?$')
+"""Pattern that matches a requirement line, capturing the name and (if pinned
+with == or ===) the version. The name (and extras) can only be followed by
+version specifiers, an environment marker or a comment."""
+
+DIRECT_REFERENCE = re.compile(r'^(?:[A-Za-z0-9][A-Za-z0-9._-]*\s*(?:\[[^\]]*\])?\s*@|[A-Za-z][A-Za-z0-9+.-]*://|\.{0,2}/|-e\b|--editable\b)|\.(?:whl|zip|tar\.gz)$')
+"""Pattern that matches a requirement on a URL, VCS checkout, local path or
+editable install (rather than on a package of the index)"""
+
+def parse_requirement_lines(lines):
+    """Yields (name, version or None) for each requirement in requirements.txt
+    formatted lines. Options (such as -r or --hash) and unpinned version
+    specifiers are ignored. Requirements that do not refer to a package of
+    the index (URLs, VCS checkouts, paths, editable installs) are skipped."""
+    logical = ""
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.endswith("\\"):
+            logical += line[:-1] + " "
+            continue
+        logical, line = "", logical + line
+        # drop trailing comments and per-requirement options such as --hash
+        line = re.split(r"\s+(?:#|-)", line, maxsplit=1)[0].strip()
+        if DIRECT_REFERENCE.search(line):
+            LOG.warning("skipping requirement that is not on the package index: %s", line)
+            continue
+        if not line or line.startswith(("#", "-")):
+            continue
+        m = REQUIREMENT.match(line)
         if m:
-            pkgs.append(m.group(1))
-    return pkgs
+            yield m.group(1), m.group(2)
+        else:
+            LOG.warning("ignoring unparseable requirement: %s", line)
+
+def parse_requirements(path):
+    """Returns (name, version or None) pairs from a requirements file, a
+    Pipfile.lock, a TOML lock file with [[package]] tables (such as
+    poetry.lock or uv.lock) or, for `-`, a requirements list on stdin."""
+    if path == "-":
+        return list(parse_requirement_lines(sys.stdin))
+    if os.path.basename(path) == "Pipfile.lock":
+        with open(path) as f:
+            lock = json.load(f)
+        return [(name, spec.get("version", "").lstrip("=") or None)
+                for section in ("default", "develop") for name, spec in lock.get(section, {}).items()]
+    if path.endswith(".lock"):
+        import tomllib
+        with open(path, "rb") as f:
+            lock = tomllib.load(f)
+        return [(pkg["name"], pkg.get("version")) for pkg in lock.get("package", [])]
+    with open(path) as f:
+        return list(parse_requirement_lines(f))
+
+def bulk_metadata(package_index, requirements, concurrency, out=sys.stdout):
+    """Fetches the metadata of many packages concurrently (each worker thread
+    keeping its connection alive) and writes one JSON object per package and
+    line as results arrive. Failures are reported per package."""
+    local = threading.local()
+
+    def fetch(name, version):
+        if not hasattr(local, "conns"):
+            local.conns = {}
+        record = {"package": name, "version": version}
+        try:
+            resp = get_package_metadata(package_index, name, version, local.conns)
+            if resp.status == 200:
+                record["metadata"] = json.loads(resp.body)
+            else:
+                record["error"] = f"{resp.status} ({resp.reason})"
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            record["error"] = str(e)
+        return record
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(fetch, name, version) for name, version in requirements]
+        for future in concurrent.futures.as_completed(futures):
+            out.write(json.dumps(future.result()) + "\n")
+            out.flush()
+
+def version_key(version):
+    """Returns a sort key that orders version strings according to PEP 440.
+    Versions that are not PEP 440 compliant sort before all others."""
+    m = VERSION_PATTERN.match(version)
+    if not m:
+        return (-1, version)
+    release = [int(i) for i in m.group("release").split(".")]
+    while len(release) > 1 and release[-1] == 0:
+        release.pop()
+    post_n = m.group("post_n1") or m.group("post_n2")
+    is_post = m.group("post_l") is not None or post_n is not None
+    is_dev = m.group("dev_l") is not None
+    # tuples standing in for -infinity (-1,) and +infinity (1,)
+    if m.group("pre_l"):
+        pre = (0, PRE_RELEASE_RANK[m.group("pre_l").lower()], int(m.group("pre_n") or 0))
+    elif is_dev and not is_post:
+        pre = (-1,)
+    else:
+        pre = (1,)
+    post = (0, int(post_n or 0)) if is_post else (-1,)
+    dev = (0, int(m.group("dev_n") or 0)) if is_dev else (1,)
+    local = (-1,)
+    if m.group("local"):
+        local = (0, tuple((1, int(p), "") if p.isdigit() else (0, 0, p.lower())
+                          for p in re.split(r"[-_.]", m.group("local"))))
+    return (0, int(m.group("epoch") or 0), tuple(release), pre, post, dev, local)
+
+def is_prerelease(version):
+    m = VERSION_PATTERN.match(version)
+    return bool(m and (m.group("pre_l") or m.group("dev_l")))
+
+def release_tuple(version):
+    m = VERSION_PATTERN.match(version)
+    return tuple(int(i) for i in m.group("release").split(".")) if m else ()
+
+def matches_specifier(version, specifier):
+    """Returns True if the version satisfies a comma-separated set of PEP 440
+    specifiers, such as ">=1.0,<2" or "~=1.4.2" or "==1.*". The local label
+    of the version (as in 1.0+local) is ignored, unless an ==/!= specifier
+    has one too."""
+    # the public version, without any local label
+    key = version_key(version.split("+", 1)[0])
+    release = release_tuple(version)
+    for spec in filter(None, (s.strip() for s in specifier.split(","))):
+        m = re.match(r"^(~=|===|==|!=|<=|>=|<|>)\s*(.+)$", spec)
+        if not m:
+            raise ValueError(f"invalid version specifier: {spec}")
+        op, target = m.groups()
+        if op in ("==", "!=") and target.endswith(".*"):
+            prefix = release_tuple(target[:-2])
+            # zero-pad, so that 1.0 matches ==1.0.0.*
+            padded = release + (0,) * (len(prefix) - len(release))
+            equal = padded[:len(prefix)] == prefix
+            ok = equal if op == "==" else not equal
+        elif op == "~=":
+            upper = release_tuple(target)[:-1]
+            padded = release + (0,) * (len(upper) - len(release))
+            ok = key >= version_key(target) and padded[:len(upper)] == upper
+        elif op == "===":
+            ok = version == target
+        elif op in ("==", "!=") and "+" in target:
+            equal = version_key(version) == version_key(target)
+            ok = equal if op == "==" else not equal
+        else:
+            target_key = version_key(target)
+            ok = {"==": key == target_key, "!=": key != target_key, "<": key < target_key,
+                  "<=": key <= target_key, ">": key > target_key, ">=": key >= target_key}[op]
+            # <V excludes pre-releases of V and >V excludes post-releases of V
+            same_release = key[0] == 0 and target_key[0] == 0 and key[1:3] == target_key[1:3]
+            if op == "<" and same_release and is_prerelease(version) and not is_prerelease(target):
+                ok = False
+            if op == ">" and same_release and key[4] != (-1,) and target_key[4] == (-1,):
+                ok = False
+        if not ok:
+            return False
+    return True
+
+def release_dists(index, version):
+    """Returns the distributions of a release in a version index, or None.
+    The version may be given in any PEP 440 equivalent spelling."""
+    if version in index["dists"]:
+        return index["dists"][version]
+    key = version_key(version)
+    for candidate in index["versions"]:
+        if version_key(candidate) == key:
+            return index["dists"][candidate]
+    return None
+
+class MetadataCache:
+    """Caches a package index's project JSON per package on disk and
+    revalidates it with ETag/Last-Modified conditional requests once it is
+    older than `max_age` seconds.
+
+    Next to each project JSON a version index is kept: the release versions
+    in PEP 440 order plus each release's distributions, without the project
+    `info` (which holds the often large description). Version queries only
+    load the index.
+    """
+
+    def __init__(self, cache_dir, package_index, max_age):
+        self.path = os.path.join(cache_dir, package_index)
+        self.package_index = package_index
+        self.max_age = max_age
+
+    def _path(self, package, suffix):
+        return os.path.join(self.path, normalize(package) + suffix)
+
+    def _write(self, path, data):
+        # a temporary file of its own: concurrent refreshes of a package never clash
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.path, delete=False) as f:
+            f.write(data)
+        os.replace(f.name, path)
+
+    def refresh_or_die(self, package):
+        try:
+            self.refresh(package)
+        except RuntimeError as e:
+            LOG.error("%s", e)
+            sys.exit(1)
+
+    def refresh(self, package):
+        """Makes sure the cached project JSON and version index are current."""
+        meta_path = self._path(package, ".meta")
+        meta = {}
+        if os.path.isfile(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if time.time() - meta["fetched"] < self.max_age:
+                return
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        resp = get(f"https://{self.package_index}/pypi/{package}/json", headers=headers)
+        if resp.status == 304 and meta:
+            LOG.debug("cached metadata for %s still valid", package)
+        elif resp.status == 200:
+            os.makedirs(self.path, exist_ok=True)
+            self._write(self._path(package, ".json"), resp.body)
+            self._write(self._path(package, ".versions.json"), json.dumps(self._version_index(json.loads(resp.body))))
+            meta = {"etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+        else:
+            raise RuntimeError(f"pypi.org query failed: {resp.status} ({resp.reason})")
+        meta["fetched"] = time.time()
+        self._write(meta_path, json.dumps(meta))
+
+    def _version_index(self, pkg):
+        releases = pkg["releases"]
+        return {"versions": sorted(releases, key=version_key), "dists": releases}
+
+    def metadata_or_die(self, package):
+        """Returns the full project JSON."""
+        self.refresh_or_die(package)
+        with open(self._path(package, ".json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def version_index_or_die(self, package):
+        self.refresh_or_die(package)
+        return self.load_version_index(package)
+
+    def load_version_index(self, package):
+        """Returns the cached version index as is (see `refresh`)."""
+        with open(self._path(package, ".versions.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def versions_or_die(self, package, specifier=None, prereleases=True):
+        """Returns the package's versions in PEP 440 order, optionally only
+        those matching a specifier."""
+        versions = self.version_index_or_die(package)["versions"]
+        if not prereleases:
+            versions = [v for v in versions if not is_prerelease(v)]
+        if specifier:
+            versions = [v for v in versions if matches_specifier(v, specifier)]
+        return versions
+
+    def dists_or_die(self, package, version):
+        """Returns the distributions of a release, which may be given in any
+        PEP 440 equivalent spelling (such as 1.0 for 1.0.0)."""
+        return release_dists(self.version_index_or_die(package), version) or []
+
+WHEEL_FILENAME = re.compile(r"^(?P<name>[^-]+)-(?P<version>[^-]+)(?:-(?P<build>\d[^-]*))?-(?P<python>[^-]+)-(?P<abi>[^-]+)-(?P<platform>[^-]+)\.whl$")
+"""Pattern that matches a wheel filename (PEP 427)"""
+
+MACOS_BINARY_FORMATS = {
+    "x86_64": ["x86_64", "intel", "fat64", "fat3", "universal2", "universal"],
+    "arm64": ["arm64", "universal2"],
+}
+
+MANYLINUX_LEGACY_ALIASES = {(2, 17): "manylinux2014", (2, 12): "manylinux2010", (2, 5): "manylinux1"}
+
+def wheel_tags(filename):
+    """Returns the set of (python, abi, platform) tag tuples of a wheel,
+    expanding compressed tag sets such as py2.py3-none-any."""
+    m = WHEEL_FILENAME.match(filename)
+    if not m:
+        return frozenset()
+    return frozenset((py, abi, plat) for py in m.group("python").split(".")
+                     for abi in m.group("abi").split(".")
+                     for plat in m.group("platform").split("."))
+
+def target_platforms(platform):
+    """Returns the platform tags a target platform accepts, most preferred
+    first. For example, manylinux_2_17_x86_64 also accepts older manylinux
+    (and their legacy alias) tags and linux_x86_64."""
+    m = re.match(r"^manylinux_(\d+)_(\d+)_(.+)$", platform)
+    if m:
+        major, minor, arch = int(m.group(1)), int(m.group(2)), m.group(3)
+        platforms = []
+        for glibc_minor in range(minor, 4, -1):
+            platforms.append(f"manylinux_{major}_{glibc_minor}_{arch}")
+            if (major, glibc_minor) in MANYLINUX_LEGACY_ALIASES:
+                platforms.append(f"{MANYLINUX_LEGACY_ALIASES[(major, glibc_minor)]}_{arch}")
+        return platforms + [f"linux_{arch}"]
+    m = re.match(r"^musllinux_(\d+)_(\d+)_(.+)$", platform)
+    if m:
+        major, minor, arch = int(m.group(1)), int(m.group(2)), m.group(3)
+        return [f"musllinux_{major}_{v}_{arch}" for v in range(minor, -1, -1)] + [f"linux_{arch}"]
+    m = re.match(r"^macosx_(\d+)_(\d+)_(.+)$", platform)
+    if m:
+        major, minor, arch = int(m.group(1)), int(m.group(2)), m.group(3)
+        formats = MACOS_BINARY_FORMATS.get(arch, [arch])
+        if major < 11:
+            return [f"macosx_10_{v}_{fmt}" for v in range(minor, 3, -1) for fmt in formats]
+        # since macOS 11 only the major version is bumped yearly. Older (10.x)
+        # binaries run on x86_64 and, as universal2 binaries, on arm64 too.
+        platforms = [f"macosx_{v}_0_{fmt}" for v in range(major, 10, -1) for fmt in formats]
+        if arch != "x86_64":
+            formats = ["universal2"]
+        return platforms + [f"macosx_10_{v}_{fmt}" for v in range(16, 3, -1) for fmt in formats]
+    return [platform]
+
+def target_tags(target):
+    """Returns a dict of the (python, abi, platform) tags a target accepts,
+    mapped to their priority (lower is preferred), in the order pip uses.
+    A target is an interpreter and a platform tag, for example
+    cp311-manylinux_2_17_x86_64 or cp312-win_amd64."""
+    m = re.match(r"^(cp|py)(\d)(\d+)-(.+)$", target)
+    if not m:
+        raise ValueError(f"invalid target: {target} (expected for example cp311-manylinux_2_17_x86_64)")
+    impl, major, minor, platform = m.group(1), m.group(2), int(m.group(3)), m.group(4)
+    platforms = target_platforms(platform)
+    tags = []
+    if impl == "cp":
+        interpreter = f"cp{major}{minor}"
+        for abi in [interpreter, "abi3", "none"]:
+            tags += [(interpreter, abi, plat) for plat in platforms]
+        for older in range(minor - 1, 1, -1):
+            tags += [(f"cp{major}{older}", "abi3", plat) for plat in platforms]
+    py_versions = [f"py{major}{minor}", f"py{major}"] + [f"py{major}{v}" for v in range(minor - 1, -1, -1)]
+    for py in py_versions:
+        tags += [(py, "none", plat) for plat in platforms]
+    if impl == "cp":
+        tags.append((f"cp{major}{minor}", "none", "any"))
+    tags += [(py, "none", "any") for py in py_versions]
+    priorities = {}
+    for tag in tags:
+        priorities.setdefault(tag, len(priorities))
+    return priorities
+
+def resolve_wheels(cache, requirements, targets, concurrency, out=sys.stdout):
+    """Picks the wheel that each target would install for each package and
+    writes one JSON object per package and target. Unpinned packages resolve
+    to their latest final release with files that are not yanked (as pip
+    does). Project metadata is refreshed concurrently; each package's wheel
+    tags are parsed once and matched against all targets."""
+    target_priorities = {target: target_tags(target) for target in targets}
+    requirements = list(dict.fromkeys(requirements))
+
+    def refresh(requirement):
+        try:
+            cache.refresh(requirement[0])
+        except (RuntimeError, OSError, http.client.HTTPException) as e:
+            return requirement, str(e)
+        return requirement, None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for (name, version), error in executor.map(refresh, requirements):
+            if error is None:
+                index = cache.load_version_index(name)
+                if version is None:
+                    finals = [v for v in index["versions"] if not is_prerelease(v)
+                              and not all(dist.get("yanked") for dist in index["dists"][v])]
+                    version = finals[-1] if finals else None
+                dists = release_dists(index, version) if version else None
+                if dists is None:
+                    error = f"no such version: {version}"
+            if error:
+                for target in targets:
+                    out.write(json.dumps({"package": name, "version": version, "target": target, "error": error}) + "\n")
+                continue
+            wheels = [(dist, wheel_tags(dist["filename"])) for dist in dists if dist["filename"].endswith(".whl")]
+            for target, priorities in target_priorities.items():
+                best, best_priority = None, len(priorities)
+                for dist, tags in wheels:
+                    priority = min((priorities[t] for t in tags if t in priorities), default=len(priorities))
+                    if priority < best_priority:
+                        best, best_priority = dist, priority
+                out.write(json.dumps({"package": name, "version": version, "target": target,
+                                      "wheel": best["filename"] if best else None,
+                                      "url": best["url"] if best else None}) + "\n")
+
+def metadata_cache(args):
+    return MetadataCache(args.cache_dir, args.package_index, args.max_cache_age)
 
 def sdist(args):
     """Implementation of the `sdist` subcommand."""
-    pkg = get_package_metadata_or_die(args.package_index, args.package)
-    for version, dists in pkg["releases"].items():
-        if version == args.version:
-            for dist in dists:
-                if dist["packagetype"] == "sdist":
-                    print(dist["url"])
-                    break
+    for dist in metadata_cache(args).dists_or_die(args.package, args.version):
+        if dist["packagetype"] == "sdist":
+            print(dist["url"])
+            break
 
 def bdists(args):
     """Implementation of the `bdists` subcommand."""
-    pkg = get_package_metadata_or_die(args.package_index, args.package)
-    bdists = []
-    for version, dists in pkg["releases"].items():
-        if version == args.version:
-            for dist in dists:
-                if dist["packagetype"].startswith("bdist"):
-                    bdists.append(dist)
+    dists = metadata_cache(args).dists_or_die(args.package, args.version)
+    bdists = [dist for dist in dists if dist["packagetype"].startswith("bdist")]
     print(json.dumps(bdists, indent=4))
 
 
 def versions(args):
     """Implementation of the `versions` subcommand."""
-    pkg = get_package_metadata_or_die(args.package_index, args.package)
-    print("\n".join(list(pkg["releases"].keys())))
+    prereleases = args.pre or not (args.latest or args.spec)
+    versions = metadata_cache(args).versions_or_die(args.package, args.spec, prereleases)
+    if args.latest:
+        versions = versions[-1:]
+    print("\n".join(versions))
 
 
 
 def show(args):
     """Implementation of the `show` subcommand."""
-    pkg = get_package_metadata_or_die(args.package_index, args.package, args.version)
+    if args.version:
+        pkg = get_package_metadata_or_die(args.package_index, args.package, args.version)
+    else:
+        pkg = metadata_cache(args).metadata_or_die(args.package)
     print(json.dumps(pkg, indent=4))
 
 def list_packages(args):
     """Implementation of the `list` subcommand."""
-    pkg = list_packages_or_die(args.package_index)
-    print(json.dumps(pkg, indent=4))
+    if args.local:
+        store = NameStore(args.store_dir, args.package_index)
+        if not args.no_sync or not store.exists():
+            sync_name_store(store, args.package_index)
+        sys.stdout.flush()
+        store.write_names(sys.stdout.buffer, args.prefix)
+        return
+    names = (n for n in iter_packages_or_die(args.package_index) if n.lower().startswith(args.prefix.lower()))
+    if args.stream:
+        for name in names:
+            sys.stdout.write(name + "\n")
+        return
+    print(json.dumps(list(names), indent=4))
+
+def bulk(args):
+    """Implementation of the `bulk` subcommand."""
+    bulk_metadata(args.package_index, parse_requirements(args.requirements), args.concurrency)
+
+def resolve(args):
+    """Implementation of the `resolve-wheels` subcommand."""
+    resolve_wheels(metadata_cache(args), parse_requirements(args.requirements), args.target, args.concurrency)
+
+def sync_names(args):
+    """Implementation of the `sync` subcommand."""
+    store = NameStore(args.store_dir, args.package_index)
+    sync_name_store(store, args.package_index)
+    LOG.info("%s synced to serial %s", store.path, store.serial())
 
 
 
@@ -115,12 +756,43 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Fetches python package metadata from a Python Package Index (PyPi by default).")
     parser.add_argument("--package-index", dest="package_index", default="pypi.org", help="Package Index to use.")
     parser.add_argument("--verbose", action='store_true', default=False, help="Print body in error responses.")
+    parser.add_argument("--store-dir", default=NAME_STORE_DIR, help="Directory of the local package name store.")
+    parser.add_argument("--cache-dir", default=METADATA_CACHE_DIR, help="Directory in which package metadata is cached.")
+    parser.add_argument("--max-cache-age", type=int, default=3600,
+                        help="Max age in seconds of cached package metadata before it is revalidated with the package index.")
 
     subparsers = parser.add_subparsers(help="subcommands")
 
     list_cmd = subparsers.add_parser("list", help="List all PyPi package names")
+    list_cmd.add_argument("--stream", action='store_true', default=False,
+                          help="Output one package name per line as the index is downloaded, rather than a JSON list.")
+    list_cmd.add_argument("--prefix", default="", help="Only list packages whose name starts with this (case-insensitive).")
+    list_cmd.add_argument("--local", action='store_true', default=False,
+                          help="Sync the local package name store (see `sync`) and list from it, one name per line.")
+    list_cmd.add_argument("--no-sync", action='store_true', default=False,
+                          help="With --local: list the store as is, without syncing it first.")
     list_cmd.set_defaults(action=list_packages)
 
+    bulk_cmd = subparsers.add_parser("bulk", help="Show PyPi metadata for many packages (as NDJSON)")
+    bulk_cmd.add_argument(
+        "requirements", nargs='?', default="-",
+        help="A requirements.txt, Pipfile.lock, poetry.lock or uv.lock file, or `-` (default) for a requirements list on stdin. Pinned (==) versions select version metadata.")
+    bulk_cmd.add_argument("--concurrency", type=int, default=16, help="Max number of concurrent requests.")
+    bulk_cmd.set_defaults(action=bulk)
+
+    resolve_cmd = subparsers.add_parser("resolve-wheels", help="Show which wheel each target platform would install for a set of packages (as NDJSON)")
+    resolve_cmd.add_argument(
+        "requirements", nargs='?', default="-",
+        help="A requirements.txt, Pipfile.lock, poetry.lock or uv.lock file, or `-` (default) for a requirements list on stdin. Unpinned packages resolve to their latest final (non-pre-release) release that is not yanked.")
+    resolve_cmd.add_argument(
+        "--target", action="append", required=True,
+        help="Target interpreter and platform, such as cp311-manylinux_2_17_x86_64, cp312-macosx_11_0_arm64 or cp310-win_amd64 (option can occur multiple times).")
+    resolve_cmd.add_argument("--concurrency", type=int, default=16, help="Max number of concurrent metadata requests.")
+    resolve_cmd.set_defaults(action=resolve)
+
+    sync_cmd = subparsers.add_parser("sync", help="Create or incrementally update the local package name store")
+    sync_cmd.set_defaults(action=sync_names)
+
     show_cmd = subparsers.add_parser("show", help="Show all PyPi metadata for a package")
     show_cmd.add_argument(
         "package", help="The package to show information for. For example, 'jinja2'.")
@@ -128,9 +800,13 @@ if __name__ == "__main__":
         "version", nargs='?', default=None, help="The package version to show information for. For example, '2.9.6'.")
     show_cmd.set_defaults(action=show)
 
-    versions_cmd = subparsers.add_parser("versions", help="Show available versions for a package")
+    versions_cmd = subparsers.add_parser("versions", help="Show available versions for a package (in PEP 440 order)")
     versions_cmd.add_argument(
         "package", help="The package of interest. For example, 'jinja2'.")
+    versions_cmd.add_argument("--spec", help="Only versions matching these PEP 440 specifiers. For example, '>=2.9,<3'.")
+    versions_cmd.add_argument("--latest", action='store_true', default=False, help="Only show the latest (matching) version.")
+    versions_cmd.add_argument("--pre", action='store_true', default=False,
+                              help="Include pre-releases with --spec/--latest (they are always listed otherwise).")
     versions_cmd.set_defaults(action=versions)
 
     sdist_cmd = subparsers.add_parser("sdist", help="Show source (sdist) download URL for a package version")
@@ -2,28 +2,307 @@
 
 import argparse
 from argparse import HelpFormatter, RawTextHelpFormatter
+import bz2
+from concurrent.futures import ThreadPoolExecutor
+import configparser
 from datetime import datetime, timedelta
+import fnmatch
 import gzip
+import hashlib
 import http.client
+import itertools
 from io import StringIO
 import logging
 import json
+import lzma
 import os
+import platform
 import re
 import shutil
+import sqlite3
+import string
 import sys
 import tempfile
 import traceback
 import typing
 from urllib.parse import urlparse
 import xml.etree.ElementTree
-import xml.dom.pulldom
 
 LOG_LEVEL = logging.INFO
 if 'LOG_LEVEL' in os.environ:
     LOG_LEVEL = getattr(logging, os.environ['LOG_LEVEL'].upper())
 LOG = logging.getLogger(__name__)
-logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s [%(levelname)s] %(message)s', stream=sys.stdout)
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s [%(levelname)s] %(message)s', stream=sys.stderr)
+
+COMMON_NS = '{http://linux.duke.edu/metadata/common}'
+"""ElementTree namespace prefix of the primary.xml package elements."""
+RPM_NS = '{http://linux.duke.edu/metadata/rpm}'
+"""ElementTree namespace prefix of the rpm: elements of primary.xml."""
+FILELISTS_NS = '{http://linux.duke.edu/metadata/filelists}'
+"""ElementTree namespace prefix of the elements of filelists.xml."""
+OTHER_NS = '{http://linux.duke.edu/metadata/other}'
+"""ElementTree namespace prefix of the elements of other.xml."""
+
+RELATION_TAGS = ['provides', 'requires', 'conflicts', 'obsoletes', 'recommends', 'suggests', 'supplements', 'enhances']
+"""The (rpm:) dependency elements of a package format."""
+
+def iter_package_elements(f :typing.IO[bytes], tag :str=COMMON_NS + 'package') -> typing.Iterator[xml.etree.ElementTree.Element]:
+    """Yields each <package> element of a primary.xml (or, given its tag, of a
+    filelists.xml/other.xml) file as soon as it has been parsed. Elements are
+    cleared once consumed, so memory use stays constant regardless of the
+    size of the file."""
+    context = xml.etree.ElementTree.iterparse(f, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag == tag:
+            yield elem
+            # drop the consumed package element from the tree
+            root.clear()
+
+def package_record(elem :xml.etree.ElementTree.Element) -> dict:
+    """Extracts the fields of a primary.xml <package> element into a dict."""
+    version = elem.find(COMMON_NS + 'version')
+    checksum = elem.find(COMMON_NS + 'checksum')
+    time = elem.find(COMMON_NS + 'time')
+    size = elem.find(COMMON_NS + 'size')
+    record = {
+        'name': elem.findtext(COMMON_NS + 'name'),
+        'arch': elem.findtext(COMMON_NS + 'arch'),
+        'epoch': version.get('epoch'),
+        'version': version.get('ver'),
+        'release': version.get('rel'),
+        'checksum': {'type': checksum.get('type'), 'value': checksum.text} if checksum is not None else None,
+        'summary': elem.findtext(COMMON_NS + 'summary'),
+        'description': elem.findtext(COMMON_NS + 'description'),
+        'packager': elem.findtext(COMMON_NS + 'packager'),
+        'url': elem.findtext(COMMON_NS + 'url'),
+        'time': {k: int(v) for k, v in time.attrib.items()} if time is not None else None,
+        'size': {k: int(v) for k, v in size.attrib.items()} if size is not None else None,
+        'location': elem.find(COMMON_NS + 'location').get('href'),
+    }
+    fmt = elem.find(COMMON_NS + 'format')
+    if fmt is not None:
+        for tag in ['license', 'vendor', 'group', 'buildhost', 'sourcerpm']:
+            record[tag] = fmt.findtext(RPM_NS + tag)
+        for tag in RELATION_TAGS:
+            entries = fmt.find(RPM_NS + tag)
+            if entries is not None:
+                record[tag] = [dict(entry.attrib) for entry in entries]
+        record['files'] = [f.text for f in fmt.findall(COMMON_NS + 'file')]
+    return record
+
+COMPRESSIONS = {'.bz2': bz2.open, '.xz': lzma.open, '.gz': gzip.open}
+"""Supported metadata compressions (by file suffix) and how to open them."""
+
+PRIMARY_DB_SCHEMA = """
+CREATE TABLE db_info (dbversion INTEGER, checksum TEXT);
+CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY, pkgId TEXT, name TEXT, arch TEXT, version TEXT, epoch TEXT,
+    release TEXT, summary TEXT, description TEXT, url TEXT, time_file INTEGER, time_build INTEGER, rpm_license TEXT,
+    rpm_vendor TEXT, rpm_group TEXT, rpm_buildhost TEXT, rpm_sourcerpm TEXT, rpm_header_start INTEGER,
+    rpm_header_end INTEGER, rpm_packager TEXT, size_package INTEGER, size_installed INTEGER, size_archive INTEGER,
+    location_href TEXT, location_base TEXT, checksum_type TEXT);
+CREATE TABLE files (name TEXT, type TEXT, pkgKey INTEGER);
+""" + "".join(f"CREATE TABLE {tag} (name TEXT, flags TEXT, epoch TEXT, version TEXT, release TEXT, pkgKey INTEGER{', pre BOOLEAN DEFAULT FALSE' if tag == 'requires' else ''});\n"
+              for tag in RELATION_TAGS) + """
+CREATE INDEX packagename ON packages (name);
+CREATE INDEX filenames ON files (name);
+CREATE INDEX providesname ON provides (name);
+CREATE INDEX requiresname ON requires (name);
+"""
+"""Schema of a primary sqlite database. It is a subset of the createrepo
+primary_db schema (version 10), so the repo's primary_db can be queried
+like a locally built one."""
+
+def cache_path(url :str) -> str:
+    """Returns the local cache path for a URL (under /tmp)."""
+    u = urlparse(url)
+    return os.path.join("/tmp", u.netloc + u.path)
+
+def open_metadata(path :str) -> typing.IO[bytes]:
+    """Opens a (possibly compressed) metadata file, judging by its suffix."""
+    return COMPRESSIONS.get(os.path.splitext(path)[1], open)(path, 'rb')
+
+def build_primary_db(records :typing.Iterable[dict], db_path :str):
+    """Writes the given package records (see package_record) to a new primary
+    sqlite database at db_path."""
+    if os.path.exists(db_path + '.tmp'):
+        os.remove(db_path + '.tmp')
+    db = sqlite3.connect(db_path + '.tmp')
+    with db:
+        db.executescript(PRIMARY_DB_SCHEMA)
+        db.execute('INSERT INTO db_info VALUES (10, NULL)')
+        for record in records:
+            time, size, checksum = record['time'] or {}, record['size'] or {}, record['checksum'] or {}
+            key = db.execute('INSERT INTO packages (pkgId, name, arch, version, epoch, release, summary, description, url, '
+                             'time_file, time_build, rpm_license, rpm_vendor, rpm_group, rpm_buildhost, rpm_sourcerpm, '
+                             'rpm_packager, size_package, size_installed, size_archive, location_href, checksum_type) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                             (checksum.get('value'), record['name'], record['arch'], record['version'], record['epoch'],
+                              record['release'], record['summary'], record['description'], record['url'],
+                              time.get('file'), time.get('build'), record.get('license'), record.get('vendor'),
+                              record.get('group'), record.get('buildhost'), record.get('sourcerpm'), record['packager'],
+                              size.get('package'), size.get('installed'), size.get('archive'), record['location'],
+                              checksum.get('type'))).lastrowid
+            for tag in RELATION_TAGS:
+                db.executemany(f'INSERT INTO {tag} (name, flags, epoch, version, release, pkgKey) VALUES (?, ?, ?, ?, ?, ?)',
+                               [(e.get('name'), e.get('flags'), e.get('epoch'), e.get('ver'), e.get('rel'), key) for e in record.get(tag, []) if tag != 'requires'])
+            db.executemany('INSERT INTO requires (name, flags, epoch, version, release, pkgKey, pre) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           [(e.get('name'), e.get('flags'), e.get('epoch'), e.get('ver'), e.get('rel'), key, e.get('pre') == '1') for e in record.get('requires', [])])
+            db.executemany('INSERT INTO files (name, type, pkgKey) VALUES (?, ?, ?)', [(f, 'file', key) for f in record.get('files', [])])
+    db.close()
+    os.replace(db_path + '.tmp', db_path)
+
+FILELISTS_DB_SCHEMA = """
+CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY, pkgId TEXT, name TEXT, arch TEXT, epoch TEXT, version TEXT, release TEXT);
+CREATE TABLE dirs (dirKey INTEGER PRIMARY KEY, name TEXT UNIQUE);
+CREATE TABLE files (dirKey INTEGER, name TEXT, type TEXT, pkgKey INTEGER);
+"""
+"""Schema of the path index built from filelists.xml. Paths are split into a
+(shared) directory and a base name, which keeps the index compact."""
+
+def build_filelists_db(f :typing.IO[bytes], db_path :str):
+    """Streams a filelists.xml file into a new path index at db_path."""
+    if os.path.exists(db_path + '.tmp'):
+        os.remove(db_path + '.tmp')
+    db = sqlite3.connect(db_path + '.tmp')
+    dirs = {}
+    with db:
+        db.executescript(FILELISTS_DB_SCHEMA)
+        for elem in iter_package_elements(f, tag=FILELISTS_NS + 'package'):
+            version = elem.find(FILELISTS_NS + 'version')
+            key = db.execute('INSERT INTO packages (pkgId, name, arch, epoch, version, release) VALUES (?, ?, ?, ?, ?, ?)',
+                             (elem.get('pkgid'), elem.get('name'), elem.get('arch'), version.get('epoch'), version.get('ver'), version.get('rel'))).lastrowid
+            files = []
+            for file in elem.findall(FILELISTS_NS + 'file'):
+                dirname, _, basename = file.text.rpartition('/')
+                if dirname not in dirs:
+                    dirs[dirname] = db.execute('INSERT INTO dirs (name) VALUES (?)', (dirname,)).lastrowid
+                files.append((dirs[dirname], basename, file.get('type', 'file'), key))
+            db.executemany('INSERT INTO files (dirKey, name, type, pkgKey) VALUES (?, ?, ?, ?)', files)
+        db.execute('CREATE INDEX filenames ON files (dirKey, name)')
+    db.close()
+    os.replace(db_path + '.tmp', db_path)
+
+def db_record(db :sqlite3.Connection, row :sqlite3.Row) -> dict:
+    """Returns the package record (see package_record) of a row of the
+    packages table of a primary sqlite database."""
+    record = {
+        'name': row['name'],
+        'arch': row['arch'],
+        'epoch': row['epoch'],
+        'version': row['version'],
+        'release': row['release'],
+        'checksum': {'type': row['checksum_type'], 'value': row['pkgId']},
+        'summary': row['summary'],
+        'description': row['description'],
+        'packager': row['rpm_packager'],
+        'url': row['url'],
+        'time': {'file': row['time_file'], 'build': row['time_build']},
+        'size': {'package': row['size_package'], 'installed': row['size_installed'], 'archive': row['size_archive']},
+        'location': row['location_href'],
+        'license': row['rpm_license'],
+        'vendor': row['rpm_vendor'],
+        'group': row['rpm_group'],
+        'buildhost': row['rpm_buildhost'],
+        'sourcerpm': row['rpm_sourcerpm'],
+    }
+    tables = {name for (name,) in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for tag in RELATION_TAGS:
+        if tag not in tables:
+            continue
+        pre = 'pre' if tag == 'requires' else 'NULL'
+        entries = [{k: v for k, v in [('name', name), ('flags', flags), ('epoch', epoch), ('ver', ver), ('rel', rel), ('pre', '1' if pre_value else None)] if v is not None}
+                   for name, flags, epoch, ver, rel, pre_value in db.execute(f'SELECT name, flags, epoch, version, release, {pre} FROM {tag} WHERE pkgKey = ?', (row['pkgKey'],))]
+        if entries:
+            record[tag] = entries
+    record['files'] = [name for (name,) in db.execute('SELECT name FROM files WHERE pkgKey = ?', (row['pkgKey'],))]
+    return record
+
+def _compare_version_segments(a :str, b :str) -> int:
+    """Compares two version (or release) strings like rpm's rpmvercmp: by
+    alternately comparing numeric and alphabetic segments, where `~` sorts
+    before anything (even the end of the string) and `^` after the end of
+    the string but before anything else."""
+    if a == b:
+        return 0
+    i = j = 0
+    while i < len(a) or j < len(b):
+        while i < len(a) and not a[i].isascii() or i < len(a) and not a[i].isalnum() and a[i] not in '~^':
+            i += 1
+        while j < len(b) and not b[j].isascii() or j < len(b) and not b[j].isalnum() and b[j] not in '~^':
+            j += 1
+        ca, cb = a[i:i + 1], b[j:j + 1]
+        if ca == '~' or cb == '~':
+            if ca != '~':
+                return 1
+            if cb != '~':
+                return -1
+            i, j = i + 1, j + 1
+            continue
+        if ca == '^' or cb == '^':
+            if not ca:
+                return -1
+            if not cb:
+                return 1
+            if ca != '^':
+                return 1
+            if cb != '^':
+                return -1
+            i, j = i + 1, j + 1
+            continue
+        if not (ca and cb):
+            break
+        numeric = ca.isdigit()
+        kind = str.isdigit if numeric else (lambda c: c.isascii() and c.isalpha())
+        start_a, start_b = i, j
+        while i < len(a) and kind(a[i]):
+            i += 1
+        while j < len(b) and kind(b[j]):
+            j += 1
+        seg_a, seg_b = a[start_a:i], b[start_b:j]
+        if not seg_b:
+            # numeric segments are newer than alphabetic ones
+            return 1 if numeric else -1
+        if numeric:
+            seg_a, seg_b = seg_a.lstrip('0'), seg_b.lstrip('0')
+            if len(seg_a) != len(seg_b):
+                return 1 if len(seg_a) > len(seg_b) else -1
+        if seg_a != seg_b:
+            return 1 if seg_a > seg_b else -1
+    if i >= len(a) and j >= len(b):
+        return 0
+    return -1 if i >= len(a) else 1
+
+def compare_evr(a :typing.Tuple[str, str, str], b :typing.Tuple[str, str, str]) -> int:
+    """Compares two (epoch, version, release) tuples like rpm does. Returns a
+    negative number, zero or a positive number if a is older than, the same
+    as or newer than b."""
+    epoch_a, epoch_b = int(a[0] or 0), int(b[0] or 0)
+    if epoch_a != epoch_b:
+        return 1 if epoch_a > epoch_b else -1
+    return _compare_version_segments(a[1] or '', b[1] or '') or _compare_version_segments(a[2] or '', b[2] or '')
+
+def read_repo_file(path :str, variables :typing.Dict[str, str]) -> typing.List[str]:
+    """Returns the base URLs of the enabled repos of a yum/dnf .repo file, with
+    variables (such as $releasever and $basearch) substituted."""
+    config = configparser.ConfigParser(interpolation=None)
+    if not config.read(path):
+        raise ValueError(f'cannot read repo file: {path}')
+    urls = []
+    for section in config.sections():
+        if not config.getboolean(section, 'enabled', fallback=True):
+            continue
+        baseurl = config.get(section, 'baseurl', fallback='').split()
+        if not baseurl:
+            LOG.warning("skipping repo %s: no baseurl (mirrorlist and metalink are not supported)", section)
+            continue
+        url = string.Template(baseurl[0]).safe_substitute(variables)
+        if '$' in url:
+            raise ValueError(f'unresolved variable in baseurl of repo {section}: {url}')
+        urls.append(url)
+    if not urls:
+        raise ValueError(f'no enabled repos with a baseurl in repo file: {path}')
+    return urls
 
 def read_to(f :typing.IO[str], regexp :str) -> typing.Optional[str]:
     """Reads lines from a file until one is encountered with the given
@@ -36,7 +315,22 @@ def read_to(f :typing.IO[str], regexp :str) -> typing.Optional[str]:
 def file_age(path :str) -> int:
     """Returns the age of a file in seconds."""
     delta = datetime.now() - datetime.fromtimestamp(os.stat(path).st_mtime)
-    return delta.seconds
+    return int(delta.total_seconds())
+
+class Repomd:
+    """The (parsed) repomd.xml of a repository."""
+    NAMESPACES = {'': 'http://linux.duke.edu/metadata/repo'}
+
+    def __init__(self, text :str):
+        root = xml.etree.ElementTree.fromstring(text)
+        # data type (such as primary) -> {"location", "checksum": [type, value]}
+        self.data = {}
+        for data in root.findall('./data', self.NAMESPACES):
+            checksum = data.find('checksum', self.NAMESPACES)
+            self.data[data.get('type')] = {
+                'location': data.find('location', self.NAMESPACES).get('href'),
+                'checksum': [checksum.get('type'), checksum.text.strip()] if checksum is not None else None,
+            }
 
 class Archive:
     def __init__(self, repo, max_cache_age:int=3600):
@@ -55,17 +349,65 @@ class Archive:
     def package_list_url(self):
         """Return the repository URL for the current primary.xml.gz package list
         (as indicated by the repomd.xml file)."""
-        repomd_xml = self._get(self.repomd_url())
-        repomd_root = xml.etree.ElementTree.fromstring(repomd_xml)
-
-        primary_path = repomd_root.findall('./data[@type="primary"]/location', namespaces={'': 'http://linux.duke.edu/metadata/repo'})[0].attrib['href']
-        return f'{self.repo}/{primary_path}'
-
+        return self.metadata_url('primary')
+
+    def metadata_url(self, data_type :str) -> typing.Optional[str]:
+        """Return the repository URL of a type of metadata (such as `primary`
+        or `primary_db`) as indicated by the repomd.xml file, or None if the
+        repository does not have it."""
+        data = self.repomd().data.get(data_type)
+        if not data:
+            return None
+        return f'{self.repo}/{data["location"]}'
+
+    def repomd(self) -> Repomd:
+        """Returns the repomd.xml of the repository. It is fetched at most once
+        per Archive and the cached copy is only revalidated (with
+        If-Modified-Since) once it is older than max_cache_age."""
+        if getattr(self, '_repomd', None) is None:
+            path = cache_path(self.repomd_url())
+            if not os.path.isfile(path) or file_age(path) >= self.max_cache_age:
+                self._revalidate(self.repomd_url(), path)
+            else:
+                LOG.debug("reusing cached %s (age: %d seconds)", path, file_age(path))
+            with open(path, encoding='utf-8') as f:
+                self._repomd = Repomd(f.read())
+        return self._repomd
 
     def package_list_cache_path(self):
-        scheme = urlparse(self.package_list_url()).scheme + "://"
-        path = self.package_list_url().lstrip(scheme)
-        return os.path.join("/tmp", path)
+        return cache_path(self.package_list_url())
+
+    def _update_metadata_cache(self, data_type :str) -> str:
+        """Makes sure that a type of metadata is cached, with the checksum that
+        repomd.xml gives for it, and returns its path. The metadata is only
+        downloaded when that checksum changes (the previous file is then
+        removed)."""
+        data = self.repomd().data[data_type]
+        path = cache_path(f'{self.repo}/{data["location"]}')
+        state_path = os.path.join(os.path.dirname(cache_path(self.repomd_url())), f'{data_type}.state')
+        state = {}
+        if os.path.isfile(state_path):
+            with open(state_path) as f:
+                state = json.load(f)
+        if state.get('path') == path and state.get('checksum') == data['checksum'] and os.path.isfile(path):
+            LOG.debug("reusing cached %s (checksum unchanged)", path)
+            return path
+
+        self._download_to(f'{self.repo}/{data["location"]}', path)
+        if data['checksum']:
+            checksum_type, checksum = data['checksum']
+            digest = hashlib.new('sha1' if checksum_type == 'sha' else checksum_type)
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+            if digest.hexdigest() != checksum:
+                os.remove(path)
+                raise ValueError(f'checksum mismatch: {data["location"]}')
+        if state.get('path') and state['path'] != path and os.path.isfile(state['path']):
+            os.remove(state['path'])
+        with open(state_path, 'w') as f:
+            json.dump({'path': path, 'checksum': data['checksum']}, f)
+        return path
 
 
     # def get_release_components(self):
@@ -90,7 +432,28 @@ class Archive:
         finally:
             conn.close()
 
-    def _download_to(self, url:str, dest_path:str):
+    def _revalidate(self, url:str, path:str):
+        """Downloads url to path, unless the server reports (via
+        If-Modified-Since, with the Last-Modified time that it gave for the
+        cached copy) that the cached copy is still current."""
+        headers = {}
+        if os.path.isfile(path) and os.path.isfile(path + '.last-modified'):
+            with open(path + '.last-modified') as f:
+                headers['If-Modified-Since'] = f.read().strip()
+        response_headers = self._download_to(url, path, headers)
+        if response_headers is None:
+            LOG.debug("%s not modified", url)
+            os.utime(path)
+        elif response_headers.get('Last-Modified'):
+            with open(path + '.last-modified', 'w') as f:
+                f.write(response_headers['Last-Modified'])
+        elif os.path.isfile(path + '.last-modified'):
+            os.remove(path + '.last-modified')
+
+    def _download_to(self, url:str, dest_path:str, headers :dict=None) -> typing.Optional[http.client.HTTPMessage]:
+        """Downloads url to dest_path and returns the response headers, or None
+        (leaving dest_path as is) if the server answers a conditional request
+        with 304 Not Modified."""
         LOG.debug("downloading %s to %s ...", url, dest_path)
         path_dir = os.path.dirname(dest_path)
         if path_dir:
@@ -98,17 +461,20 @@ class Archive:
         u = urlparse(url)
         conn = self._connect(u)
         try:
-            conn.request("GET", u.path)
+            conn.request("GET", u.path, headers=headers or {})
             resp = conn.getresponse()
+            if resp.status == 304 and headers:
+                return None
             if not resp.status == 200:
                 if resp.status in [301,302]:
                     redirect_url = str(resp.getheader('location'))
-                    self._download_to(redirect_url, dest_path)
-                    return
+                    return self._download_to(redirect_url, dest_path, headers)
                 raise ValueError(f'http error: {resp.status}')
             with resp as src:
-                with open(dest_path, "wb") as dst:
+                with open(dest_path + '.tmp', "wb") as dst:
                     shutil.copyfileobj(src, dst)
+            os.replace(dest_path + '.tmp', dest_path)
+            return resp.headers
         finally:
             conn.close()
 
@@ -123,65 +489,253 @@ class Archive:
     def download_package_list(self, dest_path :str):
         self._download_to(self.package_list_url(), dest_path)
 
-    def list_packages(self):
-        pkgs_file = self._update_package_list_cache()
-        pkgs = []
-        with gzip.open(pkgs_file, mode='rt', encoding='utf-8') as f:
-            event_stream = xml.dom.pulldom.parse(f)
-            for event, node in event_stream:
-                if event == xml.dom.pulldom.START_ELEMENT and node.tagName == "package":
-                    event_stream.expandNode(node)
-                    # merge text nodes that are split into multiple child nodes
-                    node.normalize()
-                    name_elem = node.getElementsByTagName('name')[0]
-                    v_elem = node.getElementsByTagName('version')[0]
-                    arch_elem = node.getElementsByTagName('arch')[0]
-                    pkg_name = name_elem.firstChild.nodeValue
-                    pkg_version = f"{v_elem.attributes['ver'].value}-{v_elem.attributes['rel'].value}"
-                    arch = arch_elem.firstChild.nodeValue
-                    pkgs.append(f'{pkg_name}@{pkg_version}?arch={arch}')
-        return pkgs
-
-    def get_package(self, package_name:str):
+    def list_packages(self) -> typing.Iterator[str]:
+        yield from self._query_packages('SELECT name, version, release, arch FROM packages ORDER BY pkgKey', ())
+
+    def newest_packages(self) -> typing.Iterator[typing.Tuple[str, str, tuple]]:
+        """Yields the (name, arch, (epoch, version, release)) of each package."""
+        for name, arch, epoch, version, release in self.primary_db().execute('SELECT name, arch, epoch, version, release FROM packages'):
+            yield name, arch, (epoch, version, release)
+
+    def get_packages(self, package_name :str) -> typing.List[dict]:
+        """Returns the records of all packages (all versions and arches) with a name."""
+        db = self.primary_db()
+        return [db_record(db, row) for row in db.execute('SELECT * FROM packages WHERE name = ? ORDER BY pkgKey', (package_name,))]
+
+    def iter_packages(self) -> typing.Iterator[dict]:
+        """Yields a record (see package_record) for each package of the package list."""
         pkgs_file = self._update_package_list_cache()
-        with gzip.open(pkgs_file, mode='rt', encoding='utf-8') as f:
-            event_stream = xml.dom.pulldom.parse(f)
-            for event, node in event_stream:
-                if event == xml.dom.pulldom.START_ELEMENT and node.tagName == "package":
-                    event_stream.expandNode(node)
-                    # merge text nodes that are split into multiple child nodes
-                    node.normalize()
-                    name_elem = node.getElementsByTagName('name')[0]
-                    pkg_name = name_elem.firstChild.nodeValue
-                    if pkg_name == package_name:
-                        return node.toprettyxml(indent='', newl='')
+        with open_metadata(pkgs_file) as f:
+            for elem in iter_package_elements(f):
+                yield package_record(elem)
+
+    def get_package(self, package_name:str) -> typing.Optional[dict]:
+        db = self.primary_db()
+        row = db.execute('SELECT * FROM packages WHERE name = ? ORDER BY pkgKey LIMIT 1', (package_name,)).fetchone()
+        return db_record(db, row) if row else None
+
+    def find_packages(self, name_glob :str) -> typing.Iterator[str]:
+        """Yields the packages whose names match a shell-style pattern."""
+        yield from self._query_packages('SELECT name, version, release, arch FROM packages WHERE name GLOB ? ORDER BY pkgKey', (name_glob,))
+
+    def what_provides(self, capability :str) -> typing.Iterator[str]:
+        """Yields the packages that provide a capability (a shell-style pattern)
+        such as `libc.so.6()(64bit)` or `/usr/bin/bash`. Paths are looked up
+        in the file lists of the repo (if it has them)."""
+        packages = self._query_packages('SELECT name, version, release, arch FROM packages WHERE pkgKey IN '
+                                        '(SELECT pkgKey FROM provides WHERE name GLOB ? UNION SELECT pkgKey FROM files WHERE name GLOB ?) '
+                                        'ORDER BY pkgKey', (capability, capability))
+        if capability.startswith('/') and self.metadata_url('filelists'):
+            packages = itertools.chain(packages, self.what_provides_path(capability))
+        # primary.xml also lists some of the files of each package
+        yield from dict.fromkeys(packages)
+
+    def what_provides_path(self, path :str) -> typing.Iterator[str]:
+        """Yields the packages whose file lists contain a path (a shell-style
+        pattern, such as `/usr/bin/foo` or `/usr/lib64/libssl.so.*`)."""
+        dirname, _, basename = path.rpartition('/')
+        if not re.search(r'[*?\[]', dirname):
+            # the index is only needed for the directory
+            sql = 'SELECT DISTINCT pkgKey FROM files WHERE dirKey = (SELECT dirKey FROM dirs WHERE name = ?) AND name GLOB ?'
+            params = (dirname, basename)
+        else:
+            sql = "SELECT DISTINCT pkgKey FROM files JOIN dirs USING (dirKey) WHERE dirs.name || '/' || files.name GLOB ?"
+            params = (path,)
+        db = self.filelists_db()
+        for name, version, release, arch in db.execute(f'SELECT name, version, release, arch FROM packages WHERE pkgKey IN ({sql}) ORDER BY pkgKey', params):
+            yield f'{name}@{version}-{release}?arch={arch}'
+
+    def filelists_db(self) -> sqlite3.Connection:
+        """Returns a connection to the path index, which is (re)built from
+        filelists.xml whenever that is downloaded."""
+        if getattr(self, '_filelists_db', None) is None:
+            self._filelists_db = sqlite3.connect(self._update_filelists_db())
+        return self._filelists_db
+
+    def _update_filelists_db(self) -> str:
+        source = self._update_metadata_cache('filelists')
+        db_path = os.path.join(os.path.dirname(source), 'filelists.sqlite')
+        if not os.path.isfile(db_path) or os.stat(db_path).st_mtime < os.stat(source).st_mtime:
+            LOG.debug("building %s from %s ...", db_path, source)
+            with open_metadata(source) as f:
+                build_filelists_db(f, db_path)
+        return db_path
+
+    def get_changelog(self, package :dict) -> typing.Optional[typing.List[dict]]:
+        """Returns the changelog entries of a package (a record, see
+        package_record), as read from other.xml, or None if it is not there.
+        The package is matched on its pkgid or, lacking one, on its
+        name, arch and EVR."""
+        pkgid = (package.get('checksum') or {}).get('value')
+        with open_metadata(self._update_metadata_cache('other')) as f:
+            for elem in iter_package_elements(f, tag=OTHER_NS + 'package'):
+                if pkgid:
+                    if elem.get('pkgid') != pkgid:
+                        continue
+                else:
+                    version = elem.find(OTHER_NS + 'version')
+                    if (elem.get('name'), elem.get('arch')) != (package['name'], package['arch']) or version is None or \
+                            compare_evr((version.get('epoch'), version.get('ver'), version.get('rel')),
+                                        (package['epoch'], package['version'], package['release'])) != 0:
+                        continue
+                return [{'author': entry.get('author'), 'date': int(entry.get('date')), 'text': entry.text}
+                        for entry in elem.findall(OTHER_NS + 'changelog')]
         return None
 
-    def _update_package_list_cache(self) -> str:
-        cache_path = self.package_list_cache_path()
-        if not os.path.isfile(cache_path) or (file_age(cache_path) > self.max_cache_age):
-            LOG.debug("downloading new packge list file to %s", cache_path)
-            self.download_package_list(cache_path)
+    def what_requires(self, capability :str) -> typing.Iterator[str]:
+        """Yields the packages that require a capability (a shell-style pattern)."""
+        yield from self._query_packages('SELECT name, version, release, arch FROM packages WHERE pkgKey IN '
+                                        '(SELECT pkgKey FROM requires WHERE name GLOB ?) ORDER BY pkgKey', (capability,))
+
+    def _query_packages(self, sql :str, params :tuple) -> typing.Iterator[str]:
+        for name, version, release, arch in self.primary_db().execute(sql, params):
+            yield f'{name}@{version}-{release}?arch={arch}'
+
+    def primary_db_path(self):
+        """Path of the primary sqlite database (next to the cached package list)."""
+        return os.path.join(os.path.dirname(self.package_list_cache_path()), 'primary.sqlite')
+
+    def sync(self, filelists :bool=False):
+        """Brings the (indexed) metadata of the repo up-to-date: the primary
+        database and, optionally, the path index."""
+        self._update_primary_db()
+        if filelists and self.metadata_url('filelists'):
+            self._update_filelists_db()
+
+    def primary_db(self) -> sqlite3.Connection:
+        """Returns a connection to an up-to-date primary sqlite database. This
+        is the repo's own primary_db, if it has one in a supported compression,
+        or else one that is built from primary.xml whenever that is downloaded."""
+        if getattr(self, '_db', None) is None:
+            self._db = sqlite3.connect(self._update_primary_db())
+            self._db.row_factory = sqlite3.Row
+        return self._db
+
+    def _update_primary_db(self) -> str:
+        """Makes sure that the primary sqlite database is up-to-date (once per
+        Archive) and returns its path."""
+        db_path = self.primary_db_path()
+        if getattr(self, '_db_synced', False):
+            return db_path
+        db_url = self.metadata_url('primary_db')
+        if db_url and os.path.splitext(urlparse(db_url).path)[1] in COMPRESSIONS:
+            source = self._update_metadata_cache('primary_db')
+            if not os.path.isfile(db_path) or os.stat(db_path).st_mtime < os.stat(source).st_mtime:
+                LOG.debug("decompressing %s to %s ...", source, db_path)
+                with COMPRESSIONS[os.path.splitext(source)[1]](source) as src, open(db_path + '.tmp', 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                os.replace(db_path + '.tmp', db_path)
         else:
-            LOG.debug("reusing cached %s (age: %d seconds)", cache_path, file_age(cache_path))
-        return cache_path
+            source = self._update_package_list_cache()
+            if not os.path.isfile(db_path) or os.stat(db_path).st_mtime < os.stat(source).st_mtime:
+                LOG.debug("building %s from %s ...", db_path, source)
+                build_primary_db(self.iter_packages(), db_path)
+        self._db_synced = True
+        return db_path
+
+    def _update_package_list_cache(self) -> str:
+        return self._update_metadata_cache('primary')
+
+
+def print_json_list(items :typing.Iterable):
+    """Prints items as an (indented) JSON list, one item at a time."""
+    first = True
+    for item in items:
+        print('[\n  ' if first else ',\n  ', json.dumps(item), sep='', end='')
+        first = False
+    print('[]' if first else '\n]')
+
+
+def archives(args) -> typing.List[Archive]:
+    """Returns an Archive for each of the repos given by --repo and/or
+    --repo-file, after concurrently syncing their metadata when there are
+    several of them."""
+    repos = list(getattr(args, 'repo', []))
+    if args.repo_file:
+        variables = {'basearch': args.basearch, 'arch': args.basearch}
+        if args.releasever:
+            variables['releasever'] = args.releasever
+        repos += read_repo_file(args.repo_file, variables)
+    if not repos:
+        repos = [DEFAULT_REPO]
+    archs = [Archive(repo=repo, max_cache_age=args.max_cache_age) for repo in repos]
+    if len(archs) > 1:
+        filelists = getattr(args, 'capability', '').startswith('/')
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            list(executor.map(lambda archive: archive.sync(filelists=filelists), archs))
+    return archs
+
+def newest(archs :typing.List[Archive], package_name :str) -> typing.Optional[dict]:
+    """Returns the record of the newest (by EVR) package with a name across
+    several repos (the first repo wins a tie), with its repo added."""
+    best = None
+    for archive in archs:
+        for record in archive.get_packages(package_name):
+            evr = (record['epoch'], record['version'], record['release'])
+            if best is None or compare_evr(evr, (best['epoch'], best['version'], best['release'])) > 0:
+                best = dict(record, repo=archive.repo)
+    return best
 
 
 def download_package_list(args):
     """Implementation of the `download-package-list` subcommand."""
-    archive = Archive(repo=args.repo, max_cache_age=args.max_cache_age)
-    archive.download_package_list(args.dest_path)
+    archs = archives(args)
+    if len(archs) > 1:
+        raise ValueError('download-package-list takes a single repo')
+    archs[0].download_package_list(args.dest_path)
 
 
 def list_packages(args):
     """Implementation of the `list-packages` subcommand."""
-    archive = Archive(repo=args.repo, max_cache_age=args.max_cache_age)
-    print(json.dumps(archive.list_packages(), indent=2))
+    archs = archives(args)
+    if len(archs) == 1:
+        archive = archs[0]
+        if args.name:
+            print_json_list(archive.find_packages(args.name))
+        else:
+            print_json_list(archive.list_packages())
+        return
+    # merged view: the newest EVR of each name/arch across the repos
+    packages = {}
+    for archive in archs:
+        for name, arch, evr in archive.newest_packages():
+            if args.name and not fnmatch.fnmatchcase(name, args.name):
+                continue
+            if (name, arch) not in packages or compare_evr(evr, packages[(name, arch)]) > 0:
+                packages[(name, arch)] = evr
+    print_json_list(f'{name}@{evr[1]}-{evr[2]}?arch={arch}' for (name, arch), evr in sorted(packages.items()))
+
+def whatprovides(args):
+    """Implementation of the `whatprovides` subcommand."""
+    archs = archives(args)
+    print_json_list(dict.fromkeys(pkg for archive in archs for pkg in archive.what_provides(args.capability)))
+
+def whatrequires(args):
+    """Implementation of the `whatrequires` subcommand."""
+    archs = archives(args)
+    print_json_list(dict.fromkeys(pkg for archive in archs for pkg in archive.what_requires(args.capability)))
+
+def changelog(args):
+    """Implementation of the `changelog` subcommand."""
+    archs = archives(args)
+    # the changelog of the newest package
+    package = newest(archs, args.package)
+    archive = next((archive for archive in archs if package and archive.repo == package['repo']), None)
+    entries = archive.get_changelog(package) if archive else None
+    if entries is None:
+        raise ValueError(f'no such package: {args.package}')
+    print(json.dumps(entries, indent=2))
 
 def show_package(args):
     """Implementation of the `show-package` subcommand."""
-    archive = Archive(repo=args.repo, max_cache_age=args.max_cache_age)
-    print(archive.get_package(args.package))
+    archs = archives(args)
+    if len(archs) == 1:
+        package = archs[0].get_package(args.package)
+    else:
+        package = newest(archs, args.package)
+    if package is None:
+        raise ValueError(f'no such package: {args.package}')
+    print(json.dumps(package, indent=2))
 
 
 DESCRIPTION="""
@@ -198,10 +752,23 @@ Examples:
     # list packages
     rpm-inspect.py --repo=http://mirror.centos.org/centos/8/AppStream/x86_64/os/ list-packages
 
+    # packages by name pattern, and packages that provide/require a capability
+    rpm-inspect.py --repo=http://mirror.centos.org/centos/8/AppStream/x86_64/os/ list-packages --name 'python3-*'
+    rpm-inspect.py --repo=http://mirror.centos.org/centos/8/AppStream/x86_64/os/ whatprovides 'libssl.so.1.1()(64bit)'
+    rpm-inspect.py --repo=http://mirror.centos.org/centos/8/AppStream/x86_64/os/ whatrequires 'libssl.so.1.1()(64bit)'
+    rpm-inspect.py --repo=http://mirror.centos.org/centos/8/AppStream/x86_64/os/ whatprovides /usr/bin/python3
+
     # show a particular package
     rpm-inspect.py --repo=http://download.opensuse.org/tumbleweed/repo/src-oss show-package curl
+
+    # the newest curl across several repos (or the enabled repos of a .repo file)
+    rpm-inspect.py --repo=https://dl.rockylinux.org/pub/rocky/9/BaseOS/x86_64/os --repo=https://dl.rockylinux.org/pub/rocky/9/AppStream/x86_64/os show-package curl
+    rpm-inspect.py --repo-file=/etc/yum.repos.d/rocky.repo --releasever=9 --basearch=x86_64 list-packages
 """
 
+DEFAULT_REPO = "https://mirror.nsc.liu.se/centos-store/8.4.2105/BaseOS/Source/"
+"""The repo to use when neither --repo nor --repo-file is given."""
+
 class MyHelpFormatter(argparse.ArgumentDefaultsHelpFormatter,argparse.RawTextHelpFormatter):
     """Help text formatter which both outputs defaults when calling `--help` and
     also accepts newlines in the description text."""
@@ -209,9 +776,13 @@ class MyHelpFormatter(argparse.ArgumentDefaultsHelpFormatter,argparse.RawTextHel
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=DESCRIPTION, formatter_class=MyHelpFormatter)
-    parser.add_argument("--repo", default="https://mirror.nsc.liu.se/centos-store/8.4.2105/BaseOS/Source/", help="RPM repository such as `http://download.opensuse.org/tumbleweed/repo/oss` or `http://download.opensuse.org/tumbleweed/repo/src-oss`.")
+    parser.add_argument("--repo", action="append", default=argparse.SUPPRESS, help=f"RPM repository such as `http://download.opensuse.org/tumbleweed/repo/oss` or `http://download.opensuse.org/tumbleweed/repo/src-oss`. Option can occur multiple times, in which case list-packages, show-package and changelog show the newest version (by epoch:version-release) across the repos. Default: {DEFAULT_REPO}")
+    parser.add_argument("--repo-file", help="yum/dnf .repo file whose enabled repos (with a baseurl) to use, in addition to any --repo.")
+    parser.add_argument("--releasever", help="Value of $releasever in --repo-file.")
+    parser.add_argument("--basearch", default=platform.machine(), help="Value of $basearch (and $arch) in --repo-file.")
+    parser.add_argument("--workers", type=int, default=4, help="Number of repos to sync concurrently.")
     parser.add_argument("--verbose", action='store_true', default=False, help="Print body in error responses.")
-    parser.add_argument("--max-cache-age", type=int, default=86400, help="Max cache age in seconds.")
+    parser.add_argument("--max-cache-age", type=int, default=86400, help="Max cache age in seconds (after which a cached repomd.xml is revalidated). Other metadata is re-downloaded only when its checksum in repomd.xml changes.")
 
     subparsers = parser.add_subparsers(help="subcommands")
 
@@ -221,12 +792,25 @@ if __name__ == "__main__":
 
 
     list_packages_cmd = subparsers.add_parser("list-packages", help="List all packages found in the package list")
+    list_packages_cmd.add_argument("--name", help="Only packages whose name matches a shell-style pattern such as `python3-*`.")
     list_packages_cmd.set_defaults(action=list_packages)
 
-    show_package_cmd = subparsers.add_parser("show-package", help="Show a particular package found in the package list. Note: only the first occurence of a package is shown.")
+    show_package_cmd = subparsers.add_parser("show-package", help="Show (as JSON) a particular package found in the package list. Note: only the first occurence of a package is shown.")
     show_package_cmd.add_argument("package", help="Package name")
     show_package_cmd.set_defaults(action=show_package)
 
+    whatprovides_cmd = subparsers.add_parser("whatprovides", help="List the packages that provide a capability (or, for paths, that contain a file according to filelists.xml)")
+    whatprovides_cmd.add_argument("capability", help="Capability (a shell-style pattern), such as `libc.so.6()(64bit)`, `webserver` or `/usr/bin/bash`.")
+    whatprovides_cmd.set_defaults(action=whatprovides)
+
+    changelog_cmd = subparsers.add_parser("changelog", help="Show the changelog of a particular package (from other.xml). Note: that of the newest version (by epoch:version-release, across the repos) is shown.")
+    changelog_cmd.add_argument("package", help="Package name")
+    changelog_cmd.set_defaults(action=changelog)
+
+    whatrequires_cmd = subparsers.add_parser("whatrequires", help="List the packages that require a capability")
+    whatrequires_cmd.add_argument("capability", help="Capability (a shell-style pattern), such as `libc.so.6()(64bit)`.")
+    whatrequires_cmd.set_defaults(action=whatrequires)
+
 
     args = parser.parse_args()
 
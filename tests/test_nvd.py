@@ -0,0 +1,134 @@
+import http.client
+import http.server
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import nvd
+
+BODY = json.dumps({'totalResults': 0, 'vulnerabilities': []}).encode()
+
+
+class FlakyHandler(http.server.BaseHTTPRequestHandler):
+    """Breaks the first response in the way given by `breakage` and answers
+    properly on subsequent requests."""
+    protocol_version = 'HTTP/1.1'
+    breakage = None
+    requests = 0
+
+    def do_GET(self):
+        FlakyHandler.requests += 1
+        if FlakyHandler.requests == 1 and self.breakage == 'body':
+            # a malformed chunk, cut off mid-body
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            self.wfile.write(b'a\r\n' + BODY[:10] + b'\r\nzz\r\n')
+            return
+        if FlakyHandler.requests == 1 and self.breakage == 'status':
+            # a garbled status line on a connection that is kept open
+            self.wfile.write(b'garbage\r\n')
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ClientTest(unittest.TestCase):
+
+    def setUp(self):
+        FlakyHandler.requests = 0
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/cves'
+        self.client = nvd.Client()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_retry_after_body_broken_off_mid_read(self):
+        FlakyHandler.breakage = 'body'
+        with self.assertRaises(http.client.IncompleteRead):
+            self.client.get_json(self.url)
+        self.assertEqual(self.client.get_json(self.url), json.loads(BODY))
+        self.assertEqual(FlakyHandler.requests, 2)
+
+    def test_retry_after_broken_status_line(self):
+        FlakyHandler.breakage = 'status'
+        with self.assertRaises(http.client.BadStatusLine):
+            self.client.get_json(self.url)
+        self.assertEqual(self.client.get_json(self.url), json.loads(BODY))
+        self.assertEqual(FlakyHandler.requests, 2)
+
+
+def endless_pages(window):
+    """A page generator that never runs out of pages."""
+    n = 0
+    while True:
+        n += 1
+        yield [{'cve': {'id': f'CVE-{window}-{n}'}}]
+
+
+class ShardedPagesTest(unittest.TestCase):
+
+    def test_closing_early_stops_the_workers(self):
+        before = threading.active_count()
+        pages = nvd.sharded_pages([endless_pages(w) for w in range(4)], workers=2)
+        self.assertEqual(len(next(pages)), 1)
+        pages.close()
+        deadline = time.monotonic() + 5
+        while threading.active_count() > before and time.monotonic() < deadline:
+            time.sleep(0.1)
+        self.assertEqual(threading.active_count(), before)
+
+    def test_process_exits_when_the_consumer_fails(self):
+        # as in `nvd.py list-updates ... | head -1`: the consumer raises
+        # (and the generator is never closed) while the workers are busy
+        script = f"""
+import sys
+sys.path.insert(0, {os.path.dirname(os.path.dirname(os.path.abspath(__file__)))!r})
+sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r})
+import nvd, test_nvd
+pages = nvd.sharded_pages([test_nvd.endless_pages(w) for w in range(4)], workers=2)
+next(pages)
+raise BrokenPipeError()
+"""
+        result = subprocess.run([sys.executable, '-c', script], capture_output=True, timeout=30)
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn(b'BrokenPipeError', result.stderr)
+
+
+class MirrorSearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mirror = nvd.Mirror(':memory:', create=True)
+        self.mirror.store([
+            {'cve': {'id': 'CVE-2024-0001', 'descriptions': [{'lang': 'en', 'value': 'Heap buffer overflow in libfoo.'}]}},
+            {'cve': {'id': 'CVE-2024-0002', 'descriptions': [{'lang': 'en', 'value': 'Integer overflows in "libbar".'}]}},
+        ])
+
+    def search(self, *keywords):
+        return [vuln['cve']['id'] for vuln in self.mirror.search(keywords)]
+
+    def test_words_match_as_prefixes(self):
+        self.assertEqual(self.search('over'), ['CVE-2024-0001', 'CVE-2024-0002'])
+        self.assertEqual(self.search('overflow lib'), ['CVE-2024-0001', 'CVE-2024-0002'])
+        self.assertEqual(self.search('buf', 'libfoo'), ['CVE-2024-0001'])
+        self.assertEqual(self.search('"libbar'), ['CVE-2024-0002'])
+        self.assertEqual(self.search('underflow'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
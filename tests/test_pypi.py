@@ -0,0 +1,124 @@
+import io
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pypi
+
+
+class FakeCache:
+    """A MetadataCache stand-in serving fixed version indices."""
+
+    def __init__(self, indices):
+        self.indices = indices
+
+    def refresh(self, package):
+        pass
+
+    def load_version_index(self, package):
+        return self.indices[package]
+
+
+def wheel(filename):
+    return {"filename": filename, "url": f"https://files.example/{filename}", "packagetype": "bdist_wheel"}
+
+
+class VersionTest(unittest.TestCase):
+
+    def test_local_label_is_not_a_dev_release(self):
+        self.assertFalse(pypi.is_prerelease("1.0+dev5"))
+        self.assertTrue(pypi.is_prerelease("1.0.dev"))
+        self.assertLess(pypi.version_key("1.0"), pypi.version_key("1.0+dev5"))
+        self.assertLess(pypi.version_key("1.0.dev0"), pypi.version_key("1.0"))
+
+    def test_matches_specifier(self):
+        cases = [
+            ("1.0+local", "==1.0", True),
+            ("1.0+local", "<=1.0", True),
+            ("1.0+local", ">1.0", False),
+            ("1.0+local", "!=1.0", False),
+            ("1.0+local", "==1.0+local", True),
+            ("1.0+other", "==1.0+local", False),
+            ("1.0", "==1.0.0.*", True),
+            ("1.0", "!=1.0.0.*", False),
+            ("1.1", "==1.0.*", False),
+            ("1.0.post1", ">1.0", False),
+            ("1.0rc1", "<1.0", False),
+            ("1.4", "~=1.4.0", True),
+            ("1.5", "~=1.4.0", False),
+        ]
+        for version, specifier, expected in cases:
+            with self.subTest(version=version, specifier=specifier):
+                self.assertEqual(pypi.matches_specifier(version, specifier), expected)
+
+
+class ParseRequirementLinesTest(unittest.TestCase):
+
+    def test_pinned_and_unpinned(self):
+        lines = [
+            "requests==2.31.0\n",
+            "flask[async] == 3.0.0 ; python_version >= '3.8'\n",
+            "Django>=4.2,<5  # web\n",
+            "attrs==23.*\n",
+            "zope.interface~=6.0 \\\n",
+            "    --hash=sha256:abc\n",
+            "-r other.txt\n",
+        ]
+        self.assertEqual(list(pypi.parse_requirement_lines(lines)),
+                         [("requests", "2.31.0"), ("flask", "3.0.0"), ("Django", None),
+                          ("attrs", None), ("zope.interface", None)])
+
+    def test_skips_urls_paths_and_editables(self):
+        lines = [
+            "git+https://host/repo#egg=bar",
+            "foo @ https://host/foo-1.0.tar.gz",
+            "https://files.example/pkg-1.0.tar.gz",
+            "-e ./path",
+            "--editable git+https://host/repo#egg=baz",
+            "./local/pkg",
+            "pkg-1.0-py3-none-any.whl",
+            "bar+baz",
+        ]
+        with self.assertLogs(pypi.LOG, "WARNING") as logs:
+            self.assertEqual(list(pypi.parse_requirement_lines(lines)), [])
+        self.assertEqual(len(logs.output), len(lines))
+
+
+class ResolveWheelsTest(unittest.TestCase):
+
+    def resolve(self, indices, requirements, targets):
+        out = io.StringIO()
+        pypi.resolve_wheels(FakeCache(indices), requirements, targets, 1, out=out)
+        return [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def test_arm64_accepts_older_universal2_wheel(self):
+        index = {"versions": ["1.0"], "dists": {"1.0": [
+            wheel("pkg-1.0-cp311-cp311-macosx_10_9_x86_64.whl"),
+            wheel("pkg-1.0-cp311-cp311-macosx_10_9_universal2.whl"),
+        ]}}
+        [result] = self.resolve({"pkg": index}, [("pkg", None)], ["cp311-macosx_11_0_arm64"])
+        self.assertEqual(result["wheel"], "pkg-1.0-cp311-cp311-macosx_10_9_universal2.whl")
+
+    def test_unpinned_skips_yanked_and_pre_releases(self):
+        index = {"versions": ["1.0", "1.1", "1.2", "2.0rc1"], "dists": {
+            "1.0": [wheel("pkg-1.0-py3-none-any.whl")],
+            "1.1": [wheel("pkg-1.1-py3-none-any.whl"), dict(wheel("pkg-1.1.tar.gz"), yanked=False)],
+            "1.2": [dict(wheel("pkg-1.2-py3-none-any.whl"), yanked=True)],
+            "2.0rc1": [wheel("pkg-2.0rc1-py3-none-any.whl")],
+        }}
+        [result] = self.resolve({"pkg": index}, [("pkg", None)], ["cp311-manylinux_2_17_x86_64"])
+        self.assertEqual((result["version"], result["wheel"]), ("1.1", "pkg-1.1-py3-none-any.whl"))
+
+    def test_mac_platforms_in_priority_order(self):
+        platforms = pypi.target_platforms("macosx_12_0_arm64")
+        self.assertEqual(platforms[:4], ["macosx_12_0_arm64", "macosx_12_0_universal2",
+                                         "macosx_11_0_arm64", "macosx_11_0_universal2"])
+        self.assertEqual(platforms[4:6], ["macosx_10_16_universal2", "macosx_10_15_universal2"])
+        self.assertNotIn("macosx_10_16_arm64", platforms)
+        self.assertIn("macosx_10_16_fat3", pypi.target_platforms("macosx_11_0_x86_64"))
+
+
+if __name__ == '__main__':
+    unittest.main()